@@ -15,11 +15,18 @@ import os
 import re
 import json
 import hashlib
+from collections import Counter
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-from typing import Dict, List, Any, Tuple
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+import torch
+from typing import Dict, List, Any, Tuple, Iterator, Optional
 
-from chonkie import SemanticChunker
-from chonkie.embeddings.sentence_transformer import SentenceTransformerEmbeddings
+from sentence_transformers import SentenceTransformer
 from text_cleaner import clean_medical_report 
 
 
@@ -35,6 +42,10 @@ OUTPUT_CSV = os.getenv("BIOCUP_OUTPUT_CHUNKS_CSV", DEFAULT_OUTPUT_CSV)
 OUTPUT_STATS_JSON = "biocup_chunks_stats.json"
 
 EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# On CPU, run the INT8-quantized ONNX export shipped with the model (needs optimum[onnxruntime]).
+# "torch" forces the fp32 PyTorch model; on GPU torch is always used.
+EMBEDDER_BACKEND = os.getenv("BIOCUP_EMBEDDER_BACKEND", "onnx")
+EMBEDDER_ONNX_FILE = os.getenv("BIOCUP_EMBEDDER_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
 
 MAX_CHUNK_SIZE = 520
 MIN_CHUNK_SIZE = 140
@@ -47,8 +58,40 @@ DROP_DUPLICATE_CHUNKS = True
 DROP_NEAR_DUPLICATES = True
 NEAR_DUP_SIM_THRESHOLD = 0.92  # token Jaccard overlap
 
+# MinHash-LSH for near-dup candidates (64 perms = 16 bands x 4 rows)
+MINHASH_NUM_PERM = 64
+MINHASH_BANDS = 16
+# below this many chunks per (case, section), exact Jaccard vs every previous chunk beats hashing
+NEAR_DUP_LSH_MIN_SETS = 32
+
 REQUIRED_COLS = ["case_id", "primary_site", "tcga_type", "patient_id", "report_text"]
 
+# Chunking gate: short sections stay whole, long ones are split
+_NO_SEMANTIC_CHUNK_SECTIONS = frozenset({"GENERAL", "SPECIMEN"})
+DIAGNOSIS_LONG_THRESHOLD = 1200
+SEMANTIC_MIN_CHARS = 600
+# only long narrative sections go through the embedder; other long sections use greedy_pack
+_SEMANTIC_SECTIONS = frozenset({"MICRO", "COMMENT"})
+SEMANTIC_NARRATIVE_MIN_CHARS = 900
+# a section with no more punctuation/digits than this has no boundaries worth embedding for
+STRUCTURE_MIN_CUE_CHARS = 20
+_DROP_CUE_CHARS = str.maketrans("", "", ".;:()[]0123456789")
+
+# CPU-bound per-case work runs in a process pool (embedding stays in the main process)
+CHUNKING_JOBS = int(os.getenv("BIOCUP_CHUNKING_JOBS", os.cpu_count() or 1))
+PARALLEL_MIN_CASES = 64
+PARALLEL_CHUNKSIZE = 32
+
+# Output columns (written in this order); rows are flushed every FLUSH_ROWS.
+# OUTPUT_CSV ending in ".parquet" => Parquet row groups, otherwise CSV.
+CHUNK_COLUMNS = [
+    "chunk_id", "case_id", "primary_site", "tcga_type", "patient_id",
+    "section", "original_section", "chunk_index", "sub_index", "chunk_text",
+    "has_tnm", "has_size", "has_ihc", "has_lymph", "has_margins", "has_tumor_size_cue",
+    "is_admin_noise",
+]
+FLUSH_ROWS = 50_000
+
 # =========================
 # HEADINGS
 # =========================
@@ -116,8 +159,9 @@ def normalize_heading(h: str) -> str:
 # =========================
 # CLEANING
 # =========================
-_PAGE_RE = re.compile(r"(?i)\bpage\s*:?\s*\d+\s*(of\s*\d+)?\b")
-_STATUS_RE = re.compile(r"(?i)\bstatus\s*:\s*corrected\b.*?(?=(\.\s)|$)")
+# applied on the whole text at once: [^\S\n] = whitespace that never crosses a line
+_PAGE_RE = re.compile(r"(?i)\bpage[^\S\n]*:?[^\S\n]*\d+[^\S\n]*(of[^\S\n]*\d+)?\b")
+_STATUS_RE = re.compile(r"(?im)\bstatus[^\S\n]*:[^\S\n]*corrected\b.*?(?=(\.[^\S\n])|$)")
 _RULE_RE = re.compile(r"(=|-|_){3,}")
 _WS_RE = re.compile(r"[ \t]+")
 
@@ -137,6 +181,10 @@ DROP_LINE_HINTS = re.compile(
 # keep cassette-like codes A1, B12 ... but NOT T2/N0/M1
 _CASSETTE_RE = re.compile(r"\b(?![TNM]\d)[A-HJ-Z]\d{1,2}\b")
 
+_TRIPLE_NL_RE = re.compile(r"\n{3,}")
+_WS_ALL_RE = re.compile(r"\s+")
+_DOTDOT_RE = re.compile(r"\.\s*\.")
+
 
 def clean_text_keep_lines(text: Any) -> str:
     """Clean while preserving line structure for header detection."""
@@ -144,49 +192,51 @@ def clean_text_keep_lines(text: Any) -> str:
         return ""
     t = text.replace("\x0c", "\n").replace("\r", "\n")
     t = _RULE_RE.sub("\n", t)
+    # every line separator -> "\n", then substitute on the whole text (1 call per pattern, not per line)
+    t = "\n".join(t.splitlines())
+    t = _PAGE_RE.sub(" ", t)
+    t = _STATUS_RE.sub(" ", t)
+    t = _CASSETTE_RE.sub(" ", t)
+    t = _WS_RE.sub(" ", t)
 
     lines = []
-    for ln in t.splitlines():
-        ln = _PAGE_RE.sub(" ", ln)
-        ln = _STATUS_RE.sub(" ", ln)
-        ln = _CASSETTE_RE.sub(" ", ln)
-        ln = _WS_RE.sub(" ", ln).strip()
-        if ln and DROP_LINE_HINTS.search(ln) and len(ln) < 180:
+    for ln in t.split("\n"):
+        ln = ln.strip()
+        if ln and len(ln) < 180 and DROP_LINE_HINTS.search(ln):
             continue
         lines.append(ln)
 
     t2 = "\n".join(lines)
-    t2 = re.sub(r"\n{3,}", "\n\n", t2).strip()
+    t2 = _TRIPLE_NL_RE.sub("\n\n", t2).strip()
     return t2
 
 def clean_text_flat(text: str) -> str:
     """Flatten after section detection."""
     if not text:
         return ""
-    t = text.replace("\n", " ")
-    t = re.sub(r"\s+", " ", t).strip()
-    t = re.sub(r"\.\s*\.", ".", t)
+    t = _WS_ALL_RE.sub(" ", text).strip()
+    t = _DOTDOT_RE.sub(".", t)
     return t
 
 # =========================
 # OCR NORMALIZATION (TNM)
 # =========================
+# One pass for all TNM OCR fixes (the former 5 sequential subs):
+#   pNO / pN O / pn0 -> pN0,  N O -> N 0 (rare OCR),  pT2NO / T2NO -> pT2N0 / T2N0
+# "pT2 NO" keeps the old result "pT2 N 0": the N O alternative claims it first.
+_TNM_OCR_RE = re.compile(r"(?i)\bpN(?:\s*O|0)\b|\b(N)\s*O\b|\b(p?T\d+[a-c]?)NO\b")
+
+def _tnm_fix(m: re.Match) -> str:
+    if m.group(1):
+        return m.group(1) + " 0"
+    if m.group(2):
+        return m.group(2) + "N0"
+    return "pN0"
+
 def normalize_tnm_ocr(t: str) -> str:
     if not t:
         return ""
-
-    # pNO -> pN0
-    t = re.sub(r"(?i)\bpN\s*O\b", "pN0", t)
-
-    # Only fix "NO" when it clearly belongs to TNM (near T/N/M tokens)
-    t = re.sub(r"(?i)\b(p?N)\s*O\b", r"\1 0", t)  # N O -> N 0 (rare OCR)
-    t = re.sub(r"(?i)\b(pT\d+[a-c]?)\s*NO\b", r"\1N0", t)  # pT2NO -> pT2N0
-    t = re.sub(r"(?i)\b(T\d+[a-c]?)\s*NO\b", r"\1N0", t)   # T2NO -> T2N0
-
-    # Also handle "pNO:" forms
-    t = re.sub(r"(?i)\bpN0\b", "pN0", t)  # keep consistent if needed
-
-    return t
+    return _TNM_OCR_RE.sub(_tnm_fix, t)
 
 # =========================
 # SECTION SPLITTING
@@ -194,7 +244,31 @@ def normalize_tnm_ocr(t: str) -> str:
 HEAD_RE = re.compile(
     r"(?im)^(?P<h>(" + "|".join(map(re.escape, RAW_HEADERS)) + r"))\s*[:\-]?\s*(?P<rest>.*)$"
 )
+# prefilter: a header can only start a line that begins with one of RAW_HEADERS
+_HEAD_PREFIXES = tuple(h.upper() for h in RAW_HEADERS)
+_HEAD_MAX_LEN = max(map(len, RAW_HEADERS))
+
+def find_headers(t: str) -> List[re.Match]:
+    """
+    Same matches as HEAD_RE.finditer(t), but the regex only runs at line starts
+    that pass a C-level str.startswith() check on the header prefixes.
+    """
+    matches: List[re.Match] = []
+    pos = 0
+    last_end = 0
+    for ln in t.split("\n"):
+        # a match can span lines (\s* after the header): skip the lines it consumed
+        if pos >= last_end and ln[:_HEAD_MAX_LEN].upper().startswith(_HEAD_PREFIXES):
+            m = HEAD_RE.match(t, pos)
+            if m:
+                matches.append(m)
+                last_end = m.end()
+        pos += len(ln) + 1
+    return matches
+
 INLINE_DIAG_RE = re.compile(r"(?i)\bDIAGNOSIS\b\s*[:.]")
+# short sections are kept only if they carry a clinically useful signal
+_SIG_KEEP_RE = re.compile(r"(?i)\b(?:pT|pN|ypT|ypN)\b|immuno|margin|lymph node|metast|\bcm\b|\bmm\b")
 
 def split_by_sections(report_text: str) -> List[Dict[str, str]]:
     t = clean_text_keep_lines(report_text)
@@ -203,17 +277,17 @@ def split_by_sections(report_text: str) -> List[Dict[str, str]]:
 
     # Inline DIAGNOSIS
     if INLINE_DIAG_RE.search(t):
-        pre, post = re.split(INLINE_DIAG_RE, t, maxsplit=1)
+        pre, post = INLINE_DIAG_RE.split(t, maxsplit=1)
         sections = []
         if pre.strip():
-            sections.append({"section": "GENERAL", "text": clean_text_flat(pre)})
+            sections.append({"section": "GENERAL", "text": normalize_tnm_ocr(clean_text_flat(pre))})
         if post.strip():
-            sections.append({"section": "DIAGNOSIS", "text": clean_text_flat(post)})
+            sections.append({"section": "DIAGNOSIS", "text": normalize_tnm_ocr(clean_text_flat(post))})
         return sections
 
-    matches = list(HEAD_RE.finditer(t))
+    matches = find_headers(t)
     if not matches:
-        return [{"section": "GENERAL", "text": clean_text_flat(t)}]
+        return [{"section": "GENERAL", "text": normalize_tnm_ocr(clean_text_flat(t))}]
 
     out: List[Dict[str, str]] = []
     for i, m in enumerate(matches):
@@ -232,7 +306,7 @@ def split_by_sections(report_text: str) -> List[Dict[str, str]]:
 
         if (
             len(body_flat) >= 120 or
-            re.search(r"(?i)\b(?:pT|pN|ypT|ypN)\b|immuno|margin|lymph node|metast|\bcm\b|\bmm\b", body_flat)
+            _SIG_KEEP_RE.search(body_flat)
         ):
             out.append({"section": bucket, "text": body_flat})
 
@@ -241,23 +315,115 @@ def split_by_sections(report_text: str) -> List[Dict[str, str]]:
 # =========================
 # CHONKIE INIT
 # =========================
-def init_chunker():
-    embedder = SentenceTransformerEmbeddings(EMBEDDING_MODEL)
-    return SemanticChunker(
-        embedding_model=embedder,
-        max_chunk_size=MAX_CHUNK_SIZE,
-        min_chunk_size=MIN_CHUNK_SIZE,
-        similarity_threshold=SIMILARITY_THRESHOLD
-    )
+def init_embedder() -> SentenceTransformer:
+    if EMBEDDER_BACKEND == "onnx" and not torch.cuda.is_available():
+        try:
+            return SentenceTransformer(
+                EMBEDDING_MODEL,
+                backend="onnx",
+                model_kwargs={"file_name": EMBEDDER_ONNX_FILE},
+            )
+        except Exception as e:
+            print(f"ONNX int8 embedder unavailable ({e}) -> using torch fp32")
+    return SentenceTransformer(EMBEDDING_MODEL)
+
+# =========================
+# BATCHED SEMANTIC CHUNKING
+# =========================
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENT_SPLIT_RE.split(text or "") if s.strip()]
+
+def greedy_pack(
+    sents: List[str],
+    target_lo: int = MIN_CHUNK_SIZE,
+    target_hi: int = MAX_CHUNK_SIZE,
+) -> List[str]:
+    """
+    Model-free splitter with the semantic chunker's size bounds (whitespace words
+    stand in for tokens): append sentences until the chunk reaches target_lo,
+    and cut before a sentence that would push it past target_hi.
+    """
+    chunks: List[str] = []
+    buf: List[str] = []
+    buf_len = 0
+    for s in sents:
+        n = len(s.split())
+        if buf and buf_len + n > target_hi:
+            chunks.append(" ".join(buf))
+            buf, buf_len = [], 0
+        buf.append(s)
+        buf_len += n
+        if buf_len >= target_lo:
+            chunks.append(" ".join(buf))
+            buf, buf_len = [], 0
+    if buf:
+        chunks.append(" ".join(buf))
+    return chunks
 
-def chunk_to_text(c: Any) -> str:
-    if isinstance(c, str):
-        return c
-    if hasattr(c, "text"):
-        return str(getattr(c, "text"))
-    return str(c)
+def semantic_chunk_batch(texts: List[str], embedder: SentenceTransformer) -> List[List[str]]:
+    """
+    Same boundary rule as Chonkie's SemanticChunker, but every sentence of every
+    section is embedded in ONE encode() call instead of one call per section.
+    Cut between two sentences when their cosine similarity < SIMILARITY_THRESHOLD
+    (once the chunk reached MIN_CHUNK_SIZE tokens) or when MAX_CHUNK_SIZE would be exceeded.
+    """
+    all_sents: List[str] = []
+    owner: List[int] = []
+    for ti, t in enumerate(texts):
+        sents = split_sentences(t)
+        all_sents.extend(sents)
+        owner.extend([ti] * len(sents))
+
+    out: List[List[str]] = [[] for _ in texts]
+    if not all_sents:
+        return out
+
+    n_tokens = [len(ids) for ids in embedder.tokenizer(all_sents, add_special_tokens=False)["input_ids"]]
+
+    # Smart batching: embed each distinct sentence once, sorted by token length so every
+    # batch pads to neighbours of similar length (boilerplate sentences repeat a lot across reports)
+    uniq_pos: Dict[str, int] = {}
+    uniq_tokens: List[int] = []
+    for sent, n in zip(all_sents, n_tokens):
+        if sent not in uniq_pos:
+            uniq_pos[sent] = len(uniq_tokens)
+            uniq_tokens.append(n)
+    uniq_sents = list(uniq_pos)
+    order = np.argsort(uniq_tokens, kind="stable")[::-1]
+
+    E_sorted = embedder.encode(
+        [uniq_sents[j] for j in order],
+        batch_size=1024,
+        show_progress_bar=True,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+    )
+    E_uniq = np.empty_like(E_sorted)
+    E_uniq[order] = E_sorted
+    E = E_uniq[[uniq_pos[sent] for sent in all_sents]]
+
+    # cosine(sentence i, sentence i+1) for the whole corpus at once
+    sim = (E[:-1] * E[1:]).sum(-1)
+
+    buf: List[str] = [all_sents[0]]
+    buf_tokens = n_tokens[0]
+    for k in range(1, len(all_sents)):
+        if owner[k] != owner[k - 1]:
+            out[owner[k - 1]].append(" ".join(buf))
+            buf, buf_tokens = [all_sents[k]], n_tokens[k]
+            continue
 
+        topic_shift = sim[k - 1] < SIMILARITY_THRESHOLD and buf_tokens >= MIN_CHUNK_SIZE
+        too_big = buf_tokens + n_tokens[k] > MAX_CHUNK_SIZE
+        if topic_shift or too_big:
+            out[owner[k - 1]].append(" ".join(buf))
+            buf, buf_tokens = [all_sents[k]], n_tokens[k]
+        else:
+            buf.append(all_sents[k])
+            buf_tokens += n_tokens[k]
+    out[owner[-1]].append(" ".join(buf))
 
+    return out
 
 
 # =========================
@@ -291,78 +457,140 @@ _LYMPH_RE = re.compile(
 _GROSS_CUES = re.compile(r"(?i)\b(gross|received\s+(fresh|in\s+formalin)|measuring|weighing|inked|pleural\s+surface|sectioning|submitted)\b")
 _MICRO_CUES = re.compile(r"(?i)\b(microscopic|histologic|histologic\s+grade|grade\s*[:\-]|visceral\s+pleural|lymphovascular|perineural|mitos(?:is|es)|cytologic)\b")
 
-_ADMIN_CUES = re.compile(
-    r"(?i)\b(electronic(?:ally)?\s+signed|distributed\s+to|print\s+date|verified:|continued\s+on\s+next\s+page|"
-    r"slides?\s+received|reported\s+\d{1,2}\.\d{1,2}\s*(?:am|pm)|tissue\s+bank|ischemic\s+time)\b"
-)
+def _word_alternation(alternatives: List[str], flags: int = 0) -> re.Pattern:
+    """
+    Compile \\b(?:alt1|alt2|...)\\b led by a first-char class, so `re` skips ahead
+    to candidate letters instead of starting the matcher at every position
+    (a leading \\b disables its prefix scan). Each alternative must start with a
+    plain letter; alternatives are tried in the same order.
+    """
+    firsts = "".join(sorted({a[0] for a in alternatives}))
+    body = "|".join(f"(?<={a[0]}){a[1:]}" for a in alternatives)
+    # (?<!\w.) = the \b before the consumed first char
+    return re.compile(rf"[{firsts}](?<!\w.)(?:{body})\b", flags)
+
+class _CueUnion:
+    """Presence-only search() over several patterns (first hit wins)."""
+
+    def __init__(self, *patterns: re.Pattern):
+        self.patterns = patterns
+
+    def search(self, t: str):
+        for rex in self.patterns:
+            m = rex.search(t)
+            if m:
+                return m
+        return None
+
+_ADMIN_CUES = _word_alternation([
+    r"electronic(?:ally)?\s+signed", r"distributed\s+to", r"print\s+date", r"verified:",
+    r"continued\s+on\s+next\s+page", r"slides?\s+received",
+    r"reported\s+\d{1,2}\.\d{1,2}\s*(?:am|pm)", r"tissue\s+bank", r"ischemic\s+time",
+], re.I)
 
 # ✅ Stronger specimen cues (inventory patterns)
-_SPECIMEN_CUES = re.compile(
-    r"(?im)\b("
-    r"specimen(?:s)?\s*(?:received|submitted)?|specimens?\s+(?:are|were)\s+received|"
-    r"container labeled|labeled\s+as|submitted in toto|representative sections|"
-    r"cassette|block|part\s+[A-Z]\b|"
-    r"(?:^|\s)(?:[A-Z]\.|[0-9]+\.)\s*(?:lymph\s+nodes?|lung|colon|breast|skin|biopsy|resection|lobectomy|wedge)"
-    r")\b"
+# "specimens? are/were received" is covered by the shared "specimens?" prefix
+_SPECIMEN_WORD_CUES = _word_alternation([
+    r"specimens?\s*(?:received|submitted)?", r"container labeled", r"labeled\s+as",
+    r"submitted in toto", r"representative sections", r"cassette", r"block", r"part\s+[A-Z]\b",
+], re.I | re.M)
+# inventory lines "A. lung", "2. lymph nodes" (start with a space / line start, not a letter)
+_SPECIMEN_ITEM_CUES = re.compile(
+    r"\b(?:^|\s)(?:[A-Z]\.|[0-9]+\.)\s*(?:lymph\s+nodes?|lung|colon|breast|skin|biopsy|resection|lobectomy|wedge)\b",
+    re.I | re.M,
 )
+_SPECIMEN_CUES = _CueUnion(_SPECIMEN_WORD_CUES, _SPECIMEN_ITEM_CUES)
+
+# Cue families scanned ONCE per chunk and shared by compute_flags + route_section.
+# Counted families need every hit (router scores), the others only presence.
+# (kept as separate patterns: a single fused alternation cannot report overlapping
+#  hits, e.g. "submitted in toto" is both a SPECIMEN and a GROSS cue)
+_COUNTED_CUES = {
+    "IHC": _IHC_RE,
+    "TNM": _TNM_RE,
+    "MARGIN": _MARGIN_RE,
+    "LYMPH": _LYMPH_RE,
+}
+_PRESENCE_CUES = {
+    "MEASURE": _MEASURE_RE,
+    "TUMOR_SIZE": _TUMOR_SIZE_CUE_RE,
+    "GROSS": _GROSS_CUES,
+    "MICRO": _MICRO_CUES,
+    "ADMIN": _ADMIN_CUES,
+    "SPECIMEN": _SPECIMEN_CUES,
+}
 
-def compute_flags(text: str) -> Dict[str, bool]:
-    t = normalize_tnm_ocr(text or "")
-    has_measure = bool(_MEASURE_RE.search(t))
-    has_tumor_size = bool(_TUMOR_SIZE_CUE_RE.search(t)) and has_measure
+def scan_cues(t: str) -> Dict[str, int]:
+    """Hits per cue family on an already TNM-normalized text."""
+    t = t or ""
+    hits = {name: len(rex.findall(t)) for name, rex in _COUNTED_CUES.items()}
+    for name, rex in _PRESENCE_CUES.items():
+        hits[name] = 1 if rex.search(t) else 0
+    return hits
+
+def compute_flags(text: str, cues: Dict[str, int] = None) -> Dict[str, bool]:
+    if cues is None:
+        cues = scan_cues(normalize_tnm_ocr(text or ""))
+    has_measure = bool(cues["MEASURE"])
+    has_tumor_size = bool(cues["TUMOR_SIZE"]) and has_measure
     return {
-        "has_tnm": bool(_TNM_RE.search(t)),
+        "has_tnm": bool(cues["TNM"]),
         "has_size": has_measure,
-        "has_ihc": bool(_IHC_RE.search(t)),
-        "has_lymph": bool(_LYMPH_RE.search(t)),
-        "has_margins": bool(_MARGIN_RE.search(t)),
+        "has_ihc": bool(cues["IHC"]),
+        "has_lymph": bool(cues["LYMPH"]),
+        "has_margins": bool(cues["MARGIN"]),
         "has_tumor_size_cue": has_tumor_size,
     }
 
 # =========================
 # ROUTER
 # =========================
-def _count(rex: re.Pattern, t: str) -> int:
-    return len(rex.findall(t or ""))
+_SPECIMEN_DOMINANT = frozenset({"GENERAL", "SPECIMEN"})
+_PRESERVE = frozenset({"DIAGNOSIS", "COMMENT", "CLINICAL_HISTORY", "SPECIMEN"})
+_PRIORITY = ("IHC", "SYNOPTIC", "MARGINS", "LYMPH_NODES", "MICRO", "GROSS")
 
-def route_section(original: str, chunk: str) -> str:
+def route_section(original: str, chunk: str, cues: Dict[str, int] = None) -> str:
+    """cues = scan_cues(chunk) from the caller => chunk is already TNM-normalized."""
     orig = original or "GENERAL"
-    t = normalize_tnm_ocr(chunk or "")
+    if cues is None:
+        t = normalize_tnm_ocr(chunk or "")
+        cues = scan_cues(t)
+    else:
+        t = chunk or ""
     low = t.lower()
 
     # ADMIN
-    if _ADMIN_CUES.search(t) and len(t) < 700 and not _TNM_RE.search(t):
+    if cues["ADMIN"] and len(t) < 700 and not cues["TNM"]:
         return "ADMIN"
 
     # ✅ SPECIMEN dominance first (prevents inventory -> LYMPH_NODES)
-    if orig in {"GENERAL", "SPECIMEN"} and _SPECIMEN_CUES.search(t):
+    if orig in _SPECIMEN_DOMINANT and cues["SPECIMEN"]:
         return "SPECIMEN"
     if "specimen" in low and "received" in low:
         return "SPECIMEN"
 
     # ✅ Hard TNM -> SYNOPTIC
-    if _TNM_RE.search(t) and (_count(_TNM_RE, t) >= 2 or "pathologic stage" in low or "synoptic" in low):
+    if cues["TNM"] and (cues["TNM"] >= 2 or "pathologic stage" in low or "synoptic" in low):
         return "SYNOPTIC"
 
     scores = {
-        "IHC": _count(_IHC_RE, t) + (2 if "immunohistochem" in low else 0),
-        "SYNOPTIC": _count(_TNM_RE, t) + (2 if "pathologic stage" in low else 0) + (1 if "synoptic" in low else 0),
-        "MARGINS": _count(_MARGIN_RE, t),
-        "LYMPH_NODES": _count(_LYMPH_RE, t),
-        "GROSS": (2 if _GROSS_CUES.search(t) else 0) + (1 if "measuring" in low else 0),
-        "MICRO": (2 if _MICRO_CUES.search(t) else 0) + (1 if "histologic" in low else 0),
+        "IHC": cues["IHC"] + (2 if "immunohistochem" in low else 0),
+        "SYNOPTIC": cues["TNM"] + (2 if "pathologic stage" in low else 0) + (1 if "synoptic" in low else 0),
+        "MARGINS": cues["MARGIN"],
+        "LYMPH_NODES": cues["LYMPH"],
+        "GROSS": (2 if cues["GROSS"] else 0) + (1 if "measuring" in low else 0),
+        "MICRO": (2 if cues["MICRO"] else 0) + (1 if "histologic" in low else 0),
     }
 
-    preserve = orig in {"DIAGNOSIS", "COMMENT", "CLINICAL_HISTORY", "SPECIMEN"}
+    preserve = orig in _PRESERVE
 
     best_section, best_score = max(scores.items(), key=lambda kv: kv[1])
     if best_score == 0:
         return orig if preserve else "GENERAL"
 
-    priority = ["IHC", "SYNOPTIC", "MARGINS", "LYMPH_NODES", "MICRO", "GROSS"]
     tied = [sec for sec, sc in scores.items() if sc == best_score and sc > 0]
     if len(tied) > 1:
-        for p in priority:
+        for p in _PRIORITY:
             if p in tied:
                 best_section = p
                 break
@@ -390,6 +618,12 @@ def protect_enumerations(text: str) -> str:
 def unprotect_enumerations(text: str) -> str:
     return (text or "").replace(_ITEM_MARK, "").strip()
 
+def flatten_enumerations(text: str) -> str:
+    """protect_enumerations + unprotect_enumerations in ONE pass (same "2) " -> "2. " rewrite, no <ITEM> sentinel)."""
+    if not text:
+        return ""
+    return _ENUM_RE.sub(r"\1 \2. ", text).strip()
+
 # =========================
 # PROTECT SUB-ITEMS (a), b), i), ii))
 # =========================
@@ -408,6 +642,21 @@ def protect_subitems(text: str) -> str:
 def unprotect_subitems(text: str) -> str:
     return (text or "").replace(_SUB_MARK, "").strip()
 
+# =========================
+# PROTECT / UNPROTECT BOTH (around post_split_medical)
+# =========================
+# Not fused into one union regex: each pass consumes its separator char, and the
+# sub-item pass sees the space re-emitted by the enumeration rewrite ("1. a) x" marks
+# both) while "a) b) x" only marks "a)" -> a single scan would mark other items.
+# The sub-item pass is skipped when there is no ")" at all.
+def protect_items(text: str) -> str:
+    t = protect_enumerations(text)
+    return protect_subitems(t) if ")" in t else t
+
+def unprotect_items(text: str) -> str:
+    """unprotect_subitems + unprotect_enumerations: both markers dropped, one strip."""
+    return (text or "").replace(_SUB_MARK, "").replace(_ITEM_MARK, "").strip()
+
 
 # =========================
 # POST-SPLIT (ITEM-FIRST)
@@ -415,8 +664,14 @@ def unprotect_subitems(text: str) -> str:
 # ✅ FIX: don't split on ":" (causes broken parentheses & labels)
 _SENT_SPLIT_RE = re.compile(r"(?<=[\.\;])\s+")
 
+# Pure function of the sentence and boilerplate sentences repeat across reports:
+# cache the label instead of re-running up to 8 cue scans per repeat.
+# (a fused alternation / multi-pattern set was measured slower than the separate scans with `re`)
+@lru_cache(maxsize=1 << 16)
 def _concept_label(s: str) -> str:
-    s = normalize_tnm_ocr(s or "")
+    # s is an item/sentence of post_split_medical's text, already TNM-normalized
+    # (normalize_tnm_ocr is idempotent, re-running it was a no-op rescan)
+    s = s or ""
     low = s.lower()
     if _ADMIN_CUES.search(s):
         return "ADMIN"
@@ -445,6 +700,17 @@ def _split_by_items(text: str) -> List[str]:
     parts = [p.strip() for p in t.split(_ITEM_MARK) if p.strip()]
     return parts
 
+def _one_sentence_each(segs: List[str]) -> bool:
+    """
+    " ".join(segs) splits back into exactly segs: no sentence break inside a seg,
+    and every seg but the last ends on a break char. Then the block's sentence
+    labels are the seg labels already computed by the caller.
+    """
+    return (
+        all(seg[-1] in ".;" for seg in segs[:-1])
+        and not any(_SENT_SPLIT_RE.search(seg) for seg in segs)
+    )
+
 def _sentence_group_if_mixed(text: str) -> List[str]:
     t = (text or "").strip()
     if not t:
@@ -489,8 +755,10 @@ def _split_by_subitems(text: str) -> List[str]:
     return [p.strip() for p in t.split(_SUB_MARK) if p.strip()]
 
 
-def post_split_medical(chunk_text: str) -> List[str]:
-    t = normalize_tnm_ocr((chunk_text or "").strip())
+def post_split_medical(chunk_text: str, pre_normalized: bool = False) -> List[str]:
+    t = (chunk_text or "").strip()
+    if not pre_normalized:
+        t = normalize_tnm_ocr(t)
     if not t:
         return []
 
@@ -522,18 +790,23 @@ def post_split_medical(chunk_text: str) -> List[str]:
     groups.append((cur_lab, cur))
 
     # 4) merge tiny groups into previous (avoid fragmenting)
-    merged_blocks: List[str] = []
+    # (block, uniform) - uniform: every sentence of the block is one item of this group,
+    # so they all share its label and the sentence pass would not split it
+    merged_blocks: List[Tuple[str, bool]] = []
     for lab, segs in groups:
         block = " ".join(segs).strip()
         if merged_blocks and len(block) < 140:
-            merged_blocks[-1] = (merged_blocks[-1] + " " + block).strip()
+            merged_blocks[-1] = ((merged_blocks[-1][0] + " " + block).strip(), False)
         else:
-            merged_blocks.append(block)
+            merged_blocks.append((block, _one_sentence_each(segs)))
 
-    # 5) final: sentence grouping only if mixed
+    # 5) final: sentence grouping only if mixed (labels already known for uniform blocks)
     out: List[str] = []
-    for block in merged_blocks:
-        out.extend(_sentence_group_if_mixed(block))
+    for block, uniform in merged_blocks:
+        if uniform:
+            out.append(block)
+        else:
+            out.extend(_sentence_group_if_mixed(block))
 
     # ✅ FIX: never drop small segments blindly; merge them
     out2: List[str] = []
@@ -573,36 +846,125 @@ def quality_ok(s: str) -> bool:
         return False
     return True
 
+_NUM_RE = re.compile(r"\b\d+(\.\d+)?\b")
+_NONALNUM_RE = re.compile(r"[^a-z0-9\s]")
+
 def normalize_for_dedup(s: str) -> str:
     s = (s or "").lower()
-    s = re.sub(r"\b\d+(\.\d+)?\b", "0", s)  # normalize numbers
-    s = re.sub(r"\s+", " ", s).strip()
+    s = _NUM_RE.sub("0", s)  # normalize numbers
+    s = _WS_ALL_RE.sub(" ", s).strip()
     return s
 
+def dedup_key(s: str) -> bytes:
+    """16-byte fingerprint of the normalized chunk (kept in the per-case seen set instead of the text)."""
+    return hashlib.blake2b(normalize_for_dedup(s).encode("utf-8"), digest_size=16).digest()
+
+# ASCII fast path of _NONALNUM_RE: C-level translate instead of a regex substitution
+_TOKEN_TRANS = str.maketrans({
+    chr(c): " " for c in range(128)
+    if not ("a" <= chr(c) <= "z" or "0" <= chr(c) <= "9" or chr(c).isspace())
+})
+
 def token_set(s: str) -> set:
-    s = re.sub(r"[^a-z0-9\s]", " ", (s or "").lower())
-    toks = [t for t in s.split() if len(t) > 2]
-    return set(toks)
+    s = (s or "").lower()
+    s = s.translate(_TOKEN_TRANS) if s.isascii() else _NONALNUM_RE.sub(" ", s)
+    return {t for t in s.split() if len(t) > 2}
 
 def jaccard(a: set, b: set) -> float:
     if not a or not b:
         return 0.0
     inter = len(a & b)
-    union = len(a | b)
+    union = len(a) + len(b) - inter  # |a ∪ b| without building the union set
     return inter / union if union else 0.0
 
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, 1 << 32, size=MINHASH_NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, 1 << 32, size=MINHASH_NUM_PERM, dtype=np.uint64)
+
+@lru_cache(maxsize=1 << 16)
+def token_hash(t: str) -> int:
+    """Stable 32-bit token hash (BLAKE2b): unlike hash(), not salted per process (PYTHONHASHSEED),
+    so LSH candidates are the same across runs and pool workers. 32 bits keep a*h + b < 2**64."""
+    return int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=4).digest(), "little")
+
+def minhash(tokens: set) -> np.ndarray:
+    """MinHash signature (num_perm,) of a token set: min over tokens of (a*h + b) mod p."""
+    hv = np.fromiter((token_hash(t) for t in tokens), dtype=np.uint64, count=len(tokens))
+    phv = (hv[:, None] * _PERM_A + _PERM_B) % _MERSENNE_PRIME
+    return phv.min(axis=0)
+
+class NearDupIndex:
+    """
+    LSH banding over MinHash signatures: only chunks sharing at least one band
+    are compared, and candidates are confirmed with the exact Jaccard.
+    Amortized O(1) lookups instead of comparing against every previous chunk.
+    The bands are only built once lsh_min_sets chunks are stored: most
+    (case, section) pairs hold a handful of chunks, where a direct scan is cheaper
+    than computing the signatures.
+    """
+
+    def __init__(
+        self,
+        num_perm: int = MINHASH_NUM_PERM,
+        bands: int = MINHASH_BANDS,
+        lsh_min_sets: int = NEAR_DUP_LSH_MIN_SETS,
+    ):
+        self.rows = num_perm // bands
+        self.bands = bands
+        self.lsh_min_sets = lsh_min_sets
+        self.buckets: List[Dict[bytes, List[int]]] = None
+        self.sets: List[set] = []
+
+    def _band_keys(self, sig: np.ndarray) -> List[bytes]:
+        return [sig[b * self.rows:(b + 1) * self.rows].tobytes() for b in range(self.bands)]
+
+    def _index(self, j: int) -> None:
+        for bucket, key in zip(self.buckets, self._band_keys(minhash(self.sets[j]))):
+            bucket.setdefault(key, []).append(j)
+
+    def has_near_dup(self, ts: set, thr: float) -> bool:
+        if not ts or not self.sets:
+            return False
+        if self.buckets is None:
+            return any(jaccard(ts, ps) >= thr for ps in self.sets)
+        seen = set()
+        for bucket, key in zip(self.buckets, self._band_keys(minhash(ts))):
+            for j in bucket.get(key, ()):
+                if j in seen:
+                    continue
+                seen.add(j)
+                if jaccard(ts, self.sets[j]) >= thr:
+                    return True
+        return False
+
+    def add(self, ts: set) -> None:
+        if not ts:
+            return
+        self.sets.append(ts)
+        if self.buckets is not None:
+            self._index(len(self.sets) - 1)
+        elif len(self.sets) >= self.lsh_min_sets:
+            self.buckets = [{} for _ in range(self.bands)]
+            for j in range(len(self.sets)):
+                self._index(j)
+
 # =========================
 # IDs + PREFIX
 # =========================
 def make_chunk_id(case_id: str, section: str, chunk_index: int, sub_index: int, chunk_text: str) -> str:
-    h = hashlib.md5(chunk_text.encode("utf-8", errors="ignore")).hexdigest()[:10]
+    # non-crypto fingerprint: 5-byte BLAKE2b (= 10 hex chars, no truncation)
+    h = hashlib.blake2b(chunk_text.encode("utf-8", errors="ignore"), digest_size=5).hexdigest()
     return f"{case_id}|{section}|{chunk_index}|{sub_index}|{h}"
 
-def build_context_prefix(row: pd.Series, section: str) -> str:
-    return (
-        f"[case_id={row.get('case_id','')} | site={row.get('primary_site','')} "
-        f"| type={row.get('tcga_type','')} | section={section}] "
-    )
+def context_prefix_template(case_id: Any, primary_site: Any, tcga_type: Any) -> str:
+    """Per-case prefix with a %s slot for the section (case fields are constant within a case)."""
+    def esc(v: Any) -> str:
+        return str(v).replace("%", "%%")
+    return f"[case_id={esc(case_id)} | site={esc(primary_site)} | type={esc(tcga_type)} | section=%s] "
+
+def build_context_prefix(case_id: Any, primary_site: Any, tcga_type: Any, section: str) -> str:
+    return context_prefix_template(case_id, primary_site, tcga_type) % section
 
 def paren_balance(s: str) -> int:
     s = s or ""
@@ -649,7 +1011,7 @@ def merge_until_parentheses_closed(
                 break
 
             merged = (merged + " " + nxt).strip()
-            bal = paren_balance(merged)
+            bal += paren_balance(nxt)  # balance is additive: only scan the new piece
             j += 1
             steps += 1
 
@@ -674,6 +1036,17 @@ def merge_until_parentheses_closed(
 
     return final
 
+_BULLET_RE = re.compile(r"^[-•*]\s+")
+
+# needs_merge: dispatch on the first char of nxt instead of one regex per continuation kind
+_CONT_START_CHARS = frozenset(")],;:-")   # closing bracket / punctuation (incl. "- " bullets)
+_BULLET_CHARS = frozenset("•*")
+_ITEM_START_CHARS = frozenset("abcdefghivx")  # first char of "a)".."h)" and roman "i)".."x)"
+_ROMAN_LETTER_ITEM_RE = re.compile(r"(?:i{1,3}|iv|v|vi{0,3}|ix|x|[a-h])\)")
+# hanging end "... with:." / "... and." / "... or." (checked on the tail of prev only)
+_HANGING_WITH_RE = re.compile(r"with$", re.I)
+_HANGING_AND_OR_RE = re.compile(r"(?:and|or)$", re.I)
+
 def merge_leading_bullets(chunks: List[str], max_chars: int) -> List[str]:
     """
     If a chunk starts with a bullet (- • *), attach it to the previous chunk
@@ -687,7 +1060,7 @@ def merge_leading_bullets(chunks: List[str], max_chars: int) -> List[str]:
 
         if (
             out
-            and re.match(r"^[-•*]\s+", ch)
+            and _BULLET_RE.match(ch)
             and len(out[-1]) + 1 + len(ch) <= max_chars
         ):
             out[-1] = (out[-1] + " " + ch).strip()
@@ -700,40 +1073,44 @@ def bracket_balance(s: str) -> int:
     s = s or ""
     return s.count("[") - s.count("]")
 
-def needs_merge(prev: str, nxt: str) -> bool:
+def needs_merge(prev: str, nxt: str, prev_balance: Tuple[int, int] = None) -> bool:
+    """prev_balance = (paren_balance(prev), bracket_balance(prev)) when the caller tracks it."""
     prev = (prev or "").strip()
     nxt = (nxt or "").strip()
     if not prev or not nxt:
         return False
 
     # A) delimiters not closed => MUST merge
-    if paren_balance(prev) > 0:
+    if prev_balance is None:
+        prev_balance = (paren_balance(prev), bracket_balance(prev))
+    if prev_balance[0] > 0:
         return True
-    if bracket_balance(prev) > 0:
+    if prev_balance[1] > 0:
         return True
 
     # B) nxt clearly looks like continuation
-    starts_lower = bool(re.match(r"^[a-z]", nxt))
-    starts_roman = bool(re.match(r"^(?:i{1,3}|iv|v|vi{0,3}|ix|x)\)", nxt.lower()))
-    starts_letter_item = bool(re.match(r"^[a-h]\)", nxt.lower()))  # a) b) c) ...
-    starts_punct = bool(re.match(r"^[\)\],;:\-]\s*", nxt))
-    starts_bullet = bool(re.match(r"^[-•*]\s+", nxt))
+    c0 = nxt[0]
+    if c0 in _CONT_START_CHARS:
+        return True
+    if c0 in _BULLET_CHARS and len(nxt) > 1 and nxt[1].isspace():
+        return True
+    if "a" <= c0 <= "z":  # lower-case start (a new numbered item starts with a digit)
+        return True
+    head = nxt[:6].lower()  # longest item marker is "viii)"
+    if head[0] in _ITEM_START_CHARS and _ROMAN_LETTER_ITEM_RE.match(head):  # i) iv) A) ...
+        return True
 
     # C) prev ends in "hanging" patterns
-    prev_hanging = bool(re.search(r"(?:with\s*:|and|or)\s*\.\s*$", prev, re.I)) or prev.endswith(":")
+    return prev.endswith(":") or _hanging_end(prev)
 
-    # D) special: nxt begins with ']' => definitely continuation of bracketed list
-    starts_close_bracket = nxt.startswith("]")
-
-    return (
-        starts_close_bracket
-        or starts_punct
-        or starts_bullet
-        or starts_roman
-        or starts_letter_item
-        or (starts_lower and not re.match(r"^\d+[\.\)]\s+", nxt))  # not a new numbered item
-        or prev_hanging
-    )
+def _hanging_end(prev: str) -> bool:
+    """prev (stripped) ends with "with:", "and" or "or", then "." (whitespace allowed between)."""
+    if not prev.endswith("."):
+        return False
+    t = prev[:-1].rstrip()
+    if t.endswith(":"):
+        return bool(_HANGING_WITH_RE.search(t[:-1].rstrip()[-4:]))
+    return bool(_HANGING_AND_OR_RE.search(t[-3:]))
 
 def merge_continuations(chunks: List[str], max_chars: int, max_steps: int = 8) -> List[str]:
     out: List[str] = []
@@ -746,6 +1123,8 @@ def merge_continuations(chunks: List[str], max_chars: int, max_steps: int = 8) -
 
         j = i
         steps = 0
+        # (paren, bracket) balance of cur, updated per merged piece instead of rescanning cur
+        paren, bracket = paren_balance(cur), bracket_balance(cur)
         while j + 1 < len(chunks) and steps < max_steps:
             nxt = (chunks[j + 1] or "").strip()
             if not nxt:
@@ -753,13 +1132,15 @@ def merge_continuations(chunks: List[str], max_chars: int, max_steps: int = 8) -
                 steps += 1
                 continue
 
-            if not needs_merge(cur, nxt):
+            if not needs_merge(cur, nxt, (paren, bracket)):
                 break
 
             if len(cur) + 1 + len(nxt) > max_chars:
                 break
 
             cur = (cur + " " + nxt).strip()
+            paren += paren_balance(nxt)
+            bracket += bracket_balance(nxt)
             j += 1
             steps += 1
 
@@ -772,28 +1153,8 @@ def merge_continuations(chunks: List[str], max_chars: int, max_steps: int = 8) -
 # =========================
 # MAIN PIPELINE
 # =========================
-def run_pipeline() -> None:
-    print("Loading CSV...")
-    df = pd.read_csv(INPUT_CSV)
-    
-    #adding data cleaning
-    # Appliquer la fonction à toute la colonne 'report_text'
-    df["report_text"] = df["report_text"].apply(clean_medical_report)
-
-    missing = [c for c in REQUIRED_COLS if c not in df.columns]
-    if missing:
-        raise ValueError(f"Missing required columns: {missing}. Found: {list(df.columns)}")
-
-    df = df.dropna(subset=REQUIRED_COLS).copy()
-    print(f"Loaded {len(df)} rows")
-
-    print("Initializing semantic chunker...")
-    chunker = init_chunker()
-
-    all_rows: List[Dict[str, Any]] = []
-
-    stats = {
-        "cases_total": int(len(df)),
+def _new_stats() -> Dict[str, Any]:
+    return {
         "cases_chunked": 0,
         "sections_total": 0,
         "chunks_total_raw": 0,
@@ -801,162 +1162,335 @@ def run_pipeline() -> None:
         "chunks_dropped_quality": 0,
         "chunks_dropped_duplicate_exact": 0,
         "chunks_dropped_duplicate_near": 0,
-        "chunks_by_section": {},
+        "chunks_by_section": Counter(),
         "errors_semantic_chunking": 0,
     }
 
-    print("Chunking reports...")
-    for _, row in df.iterrows():
-        report = row["report_text"]
-        sections = split_by_sections(report)
-        if not sections:
-            continue
-
-        stats["cases_chunked"] += 1
-
-        # Per-case dedup memory
-        seen_norm: set = set()
-        seen_token_sets: Dict[str, List[set]] = {}
-
-        for sec in sections:
-            orig_section = sec["section"]
-            sec_text = normalize_tnm_ocr(sec["text"])
-            stats["sections_total"] += 1
+def _merge_stats(total: Dict[str, Any], part: Dict[str, Any]) -> None:
+    for k, v in part.items():
+        if k == "chunks_by_section":
+            total[k].update(v)
+        else:
+            total[k] += v
 
-            # Protect enumerations BEFORE any chunking or splitting
-            safe_text = protect_enumerations(sec_text)
+def _case_pool(n_cases: int) -> Optional[ProcessPoolExecutor]:
+    """One process pool shared by both per-case stages (None => serial: pool start-up dominates)."""
+    if CHUNKING_JOBS <= 1 or n_cases < PARALLEL_MIN_CASES:
+        return None
+    return ProcessPoolExecutor(max_workers=CHUNKING_JOBS)
 
-            # Decide whether to semantic-chunk
-            NO_SEMANTIC_CHUNK_SECTIONS = {"GENERAL", "SPECIMEN"}
-            DIAGNOSIS_LONG_THRESHOLD = 1200
+def _map_cases(pool: Optional[ProcessPoolExecutor], fn, *iterables) -> Iterator[Any]:
+    """Lazy, order-preserving map of fn over cases (results stream back as they complete)."""
+    if pool is None:
+        return map(fn, *iterables)
+    return pool.map(fn, *iterables, chunksize=PARALLEL_CHUNKSIZE)
 
-            skip_semantic = (
-                (orig_section in NO_SEMANTIC_CHUNK_SECTIONS)
-                or (orig_section == "DIAGNOSIS" and len(safe_text) < DIAGNOSIS_LONG_THRESHOLD)
-                or (len(safe_text) < 600)
-            )
+def _has_structure(t: str) -> bool:
+    # one C-level translate pass: number of cue chars = length removed
+    return len(t) - len(t.translate(_DROP_CUE_CHARS)) > STRUCTURE_MIN_CUE_CHARS
 
-            if skip_semantic:
-                chunks = [unprotect_enumerations(safe_text)]
-            else:
-                try:
-                    chunks_obj = chunker.chunk(safe_text)
+def prepare_case(report: str) -> List[Dict[str, Any]]:
+    """
+    CPU stage 1 (no model): split a report into sections, greedy-pack the long
+    non-narrative ones and flag the ones that need semantic chunking.
+    """
+    prepared: List[Dict[str, Any]] = []
+    for sec in split_by_sections(report):
+        orig_section = sec["section"]
+        sec_text = sec["text"]  # split_by_sections returns TNM-normalized text
+
+        # Normalize enumerations ("2) " -> "2. ") BEFORE any chunking; the sentence
+        # splitter never cuts inside "2-7." so no sentinel is needed at this stage
+        flat_text = flatten_enumerations(sec_text)
+
+        # Decide whether to split at all
+        keep_whole = (
+            (orig_section in _NO_SEMANTIC_CHUNK_SECTIONS)
+            or (orig_section == "DIAGNOSIS" and len(flat_text) < DIAGNOSIS_LONG_THRESHOLD)
+            or (len(flat_text) < SEMANTIC_MIN_CHARS)
+        )
+        semantic = (
+            not keep_whole
+            and orig_section in _SEMANTIC_SECTIONS
+            and len(flat_text) >= SEMANTIC_NARRATIVE_MIN_CHARS
+        )
+        if semantic and not _has_structure(flat_text):
+            # no sentence/list boundaries to cut on: skip the embedder; kept whole only if
+            # it fits in one chunk (quality_ok would drop a longer one) -> greedy_pack otherwise
+            semantic = False
+            keep_whole = len(flat_text) <= MAX_CHARS_PER_CHUNK
+
+        item = {"section": orig_section, "text": flat_text, "semantic": semantic}
+        if not keep_whole and not semantic:
+            item["chunks"] = greedy_pack(split_sentences(flat_text))
+        prepared.append(item)
+
+    return prepared
+
+def process_case(
+    case_id: Any,
+    primary_site: Any,
+    tcga_type: Any,
+    patient_id: Any,
+    prepared: List[Dict[str, Any]],
+) -> Tuple[Dict[str, List[Any]], Dict[str, Any]]:
+    """
+    CPU stage 2: merge/post-split/route/dedup the chunks of ONE case.
+    prepared[k]["chunks"] holds the semantic / greedy-packed chunks (None => section kept whole).
+    Returns (columns, stats) so workers can be merged by the caller.
+    """
+    cols: Dict[str, List[Any]] = {c: [] for c in CHUNK_COLUMNS}
+    stats = _new_stats()
+    if not prepared:
+        return cols, stats
 
-                    # Convert objects -> str and remove <ITEM>
-                    raw_chunks = [unprotect_enumerations(chunk_to_text(c)) for c in chunks_obj]
-                    # 1) merge until () and [] are closed + continuation heuristics
-                    raw_chunks = merge_continuations(
-                        raw_chunks,
-                        max_chars=MAX_CHARS_PER_CHUNK,
-                        max_steps=10
-                    )
+    stats["cases_chunked"] = 1
+    stats["sections_total"] = len(prepared)
+    by_section = stats["chunks_by_section"]
 
+    # Built once per case, only the section changes per chunk
+    prefix_tmpl = context_prefix_template(case_id, primary_site, tcga_type)
 
-                    # 1) close parentheses by merging forward
-                    raw_chunks = merge_until_parentheses_closed(
-                        raw_chunks,
-                        max_chars=MAX_CHARS_PER_CHUNK,
-                        max_merge_steps=8,
-                    )
+    # Per-case dedup memory
+    seen_norm: set = set()  # dedup_key() fingerprints
+    seen_near: Dict[str, NearDupIndex] = {}
 
-                    # 2) attach bullet-leading chunks to previous chunk
-                    raw_chunks = merge_leading_bullets(
-                        raw_chunks,
-                        max_chars=MAX_CHARS_PER_CHUNK,
-                    )
+    for sec in prepared:
+        orig_section = sec["section"]
+        flat_text = sec["text"]
+        chunks_obj = sec.get("chunks")
 
-                    chunks = raw_chunks
+        if chunks_obj is None:
+            chunks = [flat_text]
+        else:
+            try:
+                raw_chunks = list(chunks_obj)
+                # 1) merge until () and [] are closed + continuation heuristics
+                raw_chunks = merge_continuations(
+                    raw_chunks,
+                    max_chars=MAX_CHARS_PER_CHUNK,
+                    max_steps=10
+                )
+
+
+                # 1) close parentheses by merging forward
+                raw_chunks = merge_until_parentheses_closed(
+                    raw_chunks,
+                    max_chars=MAX_CHARS_PER_CHUNK,
+                    max_merge_steps=8,
+                )
+
+                # 2) attach bullet-leading chunks to previous chunk
+                raw_chunks = merge_leading_bullets(
+                    raw_chunks,
+                    max_chars=MAX_CHARS_PER_CHUNK,
+                )
+
+                chunks = raw_chunks
+
+            except Exception:
+                stats["errors_semantic_chunking"] += 1
+                # fallback clean
+                chunks = [flat_text]
+
+        stats["chunks_total_raw"] += len(chunks)
+
+        for chunk_index, raw_chunk in enumerate(chunks):
+            raw_chunk = normalize_tnm_ocr((raw_chunk or "").strip())
+
+            if not quality_ok(raw_chunk):
+                stats["chunks_dropped_quality"] += 1
+                continue
 
-                except Exception as e:
-                    stats["errors_semantic_chunking"] += 1
-                    # fallback clean
-                    chunks = [unprotect_enumerations(safe_text)]
+            # Post-split on PROTECTED version so "2-7." stays intact
+            protected_for_split = protect_items(raw_chunk)
 
-            stats["chunks_total_raw"] += len(chunks)
+            # raw_chunk was TNM-normalized above; the markers don't create new TNM tokens
+            concept_chunks = post_split_medical(protected_for_split, pre_normalized=True)
 
-            for chunk_index, raw_chunk in enumerate(chunks):
-                raw_chunk = normalize_tnm_ocr((raw_chunk or "").strip())
+            for sub_index, cc in enumerate(concept_chunks):
+                cc = normalize_tnm_ocr(unprotect_items(cc))
 
-                if not quality_ok(raw_chunk):
+                if not quality_ok(cc):
                     stats["chunks_dropped_quality"] += 1
                     continue
 
-                # Post-split on PROTECTED version so "2-7." stays intact
-                protected_for_split = protect_enumerations(raw_chunk)
-                protected_for_split = protect_subitems(protected_for_split)
+                cues = scan_cues(cc)
+                routed_section = route_section(orig_section, cc, cues)
 
-                concept_chunks = post_split_medical(protected_for_split)
+                # exact-ish dedup
+                norm = dedup_key(cc)
+                if DROP_DUPLICATE_CHUNKS and norm in seen_norm:
+                    stats["chunks_dropped_duplicate_exact"] += 1
+                    continue
+                seen_norm.add(norm)
+
+                # near-duplicate dedup (within same case + routed section)
+                if DROP_NEAR_DUPLICATES:
+                    key = routed_section
+                    ts = token_set(cc)
+                    near_index = seen_near.setdefault(key, NearDupIndex())
+
+                    if len(cc) < 220:
+                        thr = 0.95
+                    elif len(cc) < 320:
+                        thr = 0.93
+                    else:
+                        thr = NEAR_DUP_SIM_THRESHOLD
+
+                    if near_index.has_near_dup(ts, thr):
+                        stats["chunks_dropped_duplicate_near"] += 1
+                        continue
 
-                concept_chunks = [unprotect_subitems(x) for x in concept_chunks]
+                    near_index.add(ts)
+
+                chunk_text = prefix_tmpl % routed_section + cc
+                flags = compute_flags(cc, cues)
+
+                cols["chunk_id"].append(make_chunk_id(str(case_id), routed_section, int(chunk_index), int(sub_index), cc))
+                cols["case_id"].append(case_id)
+                cols["primary_site"].append(primary_site)
+                cols["tcga_type"].append(tcga_type)
+                cols["patient_id"].append(patient_id)
+                cols["section"].append(routed_section)
+                cols["original_section"].append(orig_section)
+                cols["chunk_index"].append(int(chunk_index))
+                cols["sub_index"].append(int(sub_index))
+                cols["chunk_text"].append(chunk_text)
+                for flag, value in flags.items():
+                    cols[flag].append(value)
+                cols["is_admin_noise"].append(routed_section == "ADMIN")
+
+                stats["chunks_total_after_postsplit"] += 1
+                by_section[routed_section] += 1
+
+    return cols, stats
+
+class ChunkSink:
+    """Column-wise (SoA) chunk buffer flushed to `path` every `flush_rows` rows."""
+
+    def __init__(self, path: str, flush_rows: int = FLUSH_ROWS):
+        self.path = path
+        self.flush_rows = flush_rows
+        self.is_parquet = path.endswith(".parquet")
+        self.cols: Dict[str, List[Any]] = {c: [] for c in CHUNK_COLUMNS}
+        self.n_rows = 0
+        self._buffered = 0
+        self._writer = None
+        self._schema = None
+
+        out_dir = os.path.dirname(path)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+
+    def extend(self, cols: Dict[str, List[Any]]) -> None:
+        n = len(cols["chunk_id"])
+        for c in CHUNK_COLUMNS:
+            self.cols[c].extend(cols[c])
+        self._buffered += n
+        if self._buffered >= self.flush_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._buffered:
+            return
+        if self._schema is None:
+            # schema fixed by the first batch (an all-null column is typed as string),
+            # later batches are converted to it instead of re-inferring their types
+            inferred = pa.RecordBatch.from_pydict(self.cols).schema
+            self._schema = pa.schema([
+                pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f for f in inferred
+            ])
+            # Arrow C++ writers for both formats (CSV booleans come out as true/false)
+            if self.is_parquet:
+                self._writer = pq.ParquetWriter(self.path, self._schema, compression="snappy")
+            else:
+                self._writer = pacsv.CSVWriter(self.path, self._schema)
+        self._writer.write_batch(pa.RecordBatch.from_pydict(self.cols, schema=self._schema))
+        self.n_rows += self._buffered
+        self._buffered = 0
+        for c in CHUNK_COLUMNS:
+            self.cols[c].clear()
+
+    def close(self) -> None:
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
 
-                for sub_index, cc in enumerate(concept_chunks):
-                    cc = normalize_tnm_ocr(unprotect_enumerations(cc).strip())
+def run_pipeline() -> None:
+    print("Loading CSV...")
+    # header only first: fail fast on a bad file before parsing every report
+    found_cols = list(pd.read_csv(INPUT_CSV, nrows=0).columns)
+    missing = [c for c in REQUIRED_COLS if c not in found_cols]
+    if missing:
+        raise ValueError(f"Missing required columns: {missing}. Found: {found_cols}")
 
-                    if not quality_ok(cc):
-                        stats["chunks_dropped_quality"] += 1
-                        continue
+    # only the needed columns, parsed by the multithreaded Arrow reader into Arrow strings
+    df = pd.read_csv(INPUT_CSV, usecols=REQUIRED_COLS, engine="pyarrow", dtype_backend="pyarrow")
 
-                    routed_section = route_section(orig_section, cc)
+    # clean_medical_report maps a missing report to "", so only the other columns can drop a row
+    df = df.dropna(subset=[c for c in REQUIRED_COLS if c != "report_text"])
+    print(f"Loaded {len(df)} rows")
 
-                    # exact-ish dedup
-                    norm = normalize_for_dedup(cc)
-                    if DROP_DUPLICATE_CHUNKS and norm in seen_norm:
-                        stats["chunks_dropped_duplicate_exact"] += 1
-                        continue
-                    seen_norm.add(norm)
-
-                    # near-duplicate dedup (within same case + routed section)
-                    if DROP_NEAR_DUPLICATES:
-                        key = routed_section
-                        ts = token_set(cc)
-                        prev_sets = seen_token_sets.get(key, [])
-
-                        if len(cc) < 220:
-                            thr = 0.95
-                        elif len(cc) < 320:
-                            thr = 0.93
-                        else:
-                            thr = NEAR_DUP_SIM_THRESHOLD
-
-                        if prev_sets and any(jaccard(ts, ps) >= thr for ps in prev_sets):
-                            stats["chunks_dropped_duplicate_near"] += 1
-                            continue
-
-                        prev_sets.append(ts)
-                        seen_token_sets[key] = prev_sets
-
-                    prefix = build_context_prefix(row, routed_section)
-                    chunk_text = prefix + cc
-                    flags = compute_flags(cc)
-
-                    all_rows.append({
-                        "chunk_id": make_chunk_id(str(row["case_id"]), routed_section, int(chunk_index), int(sub_index), cc),
-                        "case_id": row["case_id"],
-                        "primary_site": row["primary_site"],
-                        "tcga_type": row["tcga_type"],
-                        "patient_id": row["patient_id"],
-                        "section": routed_section,
-                        "original_section": orig_section,
-                        "chunk_index": int(chunk_index),
-                        "sub_index": int(sub_index),
-                        "chunk_text": chunk_text,
-                        **flags,
-                        "is_admin_noise": (routed_section == "ADMIN"),
-                    })
-
-                    stats["chunks_total_after_postsplit"] += 1
-                    stats["chunks_by_section"][routed_section] = stats["chunks_by_section"].get(routed_section, 0) + 1
-
-    chunks_df = pd.DataFrame(all_rows)
-    if chunks_df.empty:
-        raise ValueError("No chunks produced. Check input and regex rules.")
+    # plain Python lists pulled out of Arrow once: no pd.Series boxing per row
+    case_ids, sites, tcgas, patient_ids, raw_reports = (
+        df[c].tolist() for c in ("case_id", "primary_site", "tcga_type", "patient_id", "report_text")
+    )
 
-    out_dir = os.path.dirname(OUTPUT_CSV)
-    if out_dir:
-        os.makedirs(out_dir, exist_ok=True)
+    #adding data cleaning
+    # Appliquer la fonction à toute la colonne 'report_text'
+    reports = [clean_medical_report(r) for r in raw_reports]
+
+    stats = {"cases_total": int(len(df)), **_new_stats()}
+
+    # 1) CPU pool: split every case into sections
+    #    (identical reports — amendments, re-ingested subsets — are split + embedded once)
+    report_keys = [hashlib.blake2b(str(r).encode("utf-8"), digest_size=16).digest() for r in reports]
+    unique_pos: Dict[bytes, int] = {}
+    unique_reports: List[str] = []
+    for key, r in zip(report_keys, reports):
+        if key not in unique_pos:
+            unique_pos[key] = len(unique_reports)
+            unique_reports.append(r)
+
+    # one pool for stages 1 and 3, started before the model is loaded (workers never fork it)
+    pool = _case_pool(len(reports))
+    try:
+        print(f"Splitting sections: {len(unique_reports)} unique reports ({CHUNKING_JOBS} jobs)...")
+        prepared_unique = list(_map_cases(pool, prepare_case, unique_reports))
+        prepared_cases = [prepared_unique[unique_pos[key]] for key in report_keys]
+
+        # 2) main process: embed all sentences of all long sections in one batch
+        semantic_secs = [sec for prepared in prepared_unique for sec in prepared if sec["semantic"]]
+        print(f"Semantic chunking {len(semantic_secs)} sections...")
+        if semantic_secs:
+            print("Initializing sentence embedder...")
+            embedder = init_embedder()
+            try:
+                semantic_chunks = semantic_chunk_batch([sec["text"] for sec in semantic_secs], embedder)
+            except Exception as e:
+                print(f"Semantic chunking failed ({e}) -> fallback to whole sections")
+                stats["errors_semantic_chunking"] += len(semantic_secs)
+                semantic_chunks = [None] * len(semantic_secs)
+            for sec, chunks in zip(semantic_secs, semantic_chunks):
+                sec["chunks"] = chunks
+
+        # 3) CPU pool: post-process per case, streamed to the sink in case order
+        print("Chunking reports...")
+        sink = ChunkSink(OUTPUT_CSV)
+        for case_cols, case_stats in _map_cases(pool, process_case, case_ids, sites, tcgas, patient_ids, prepared_cases):
+            sink.extend(case_cols)
+            _merge_stats(stats, case_stats)
+        sink.close()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if sink.n_rows == 0:
+        raise ValueError("No chunks produced. Check input and regex rules.")
 
-    print(f"Saving {len(chunks_df)} chunks -> {OUTPUT_CSV}")
-    chunks_df.to_csv(OUTPUT_CSV, index=False)
+    print(f"Saved {sink.n_rows} chunks -> {OUTPUT_CSV}")
 
     print(f"Saving stats -> {OUTPUT_STATS_JSON}")
     with open(OUTPUT_STATS_JSON, "w", encoding="utf-8") as f:
@@ -965,12 +1499,12 @@ def run_pipeline() -> None:
     print(" Done.")
     print(f"   - cases_chunked: {stats['cases_chunked']}/{stats['cases_total']}")
     print(f"   - chunks_raw: {stats['chunks_total_raw']}")
-    print(f"   - chunks_saved: {len(chunks_df)}")
+    print(f"   - chunks_saved: {sink.n_rows}")
     print(f"   - dropped_quality: {stats['chunks_dropped_quality']}")
     print(f"   - dropped_dup_exact: {stats['chunks_dropped_duplicate_exact']}")
     print(f"   - dropped_dup_near: {stats['chunks_dropped_duplicate_near']}")
     print(f"   - semantic_errors: {stats['errors_semantic_chunking']}")
-    print("   - chunks_by_section:", stats["chunks_by_section"])
+    print("   - chunks_by_section:", dict(stats["chunks_by_section"]))
 
 if __name__ == "__main__":
     run_pipeline()
@@ -1,58 +1,82 @@
 import re
+import unicodedata
 import pandas as pd
 
+# =========================
+# Patterns compilés une seule fois (à l'import, pas à chaque rapport)
+# =========================
+_DOT_UPPER_RE = re.compile(r"([a-z])\.([A-Z])")
+_DOT_LOWER_RE = re.compile(r"([a-z])\.([a-z])")
+
+# Corrections OCR fréquentes (littéraux : str.replace reste plus rapide qu'une alternance regex)
+CORRECTIONS = {
+    "tymph": "lymph",
+    "attendir g": "attending",
+    "alides": "slides",
+    "materiala": "materials",
+    "(D/": "(0/"
+}
+
+_DIGIT_DOT_RE = re.compile(r"(?<=\d)\.(?=\s*[a-zA-Z])")
+_DOT_BEFORE_LOWER_RE = re.compile(r"\s*\.\s*(?=[a-z])")
+_MULTI_DOT_RE = re.compile(r"\.{2,}")
+_EMPTY_PARENS_RE = re.compile(r"\(\s*\)")
+_PUNCT_PARENS_RE = re.compile(r"\(\s*[\W_]+\s*\)")
+_NEWLINE_RE = re.compile(r"\s*\n\s*")
+_WS_RE = re.compile(r"\s+")
+
+# Sections clés
+SECTIONS = [
+    "DIAGNOSIS",
+    "TISSUE DESCRIPTION",
+    "Comment",
+    "Key Pathological Findings",
+    "Specimen type",
+    "Clinical History",
+    "Preoperative Diagnosis",
+    "Gross Description",
+    "Intraoperative Consultation"
+]
+# (pattern, remplacement, clé minuscule pour le préfiltre)
+_SECTION_SUBS = [(re.compile(sec, re.I), f"\n\n{sec}", sec.lower()) for sec in SECTIONS]
+
+
 def clean_medical_report(text: str) -> str:
     if pd.isna(text):
         return ""
 
-    import unicodedata
     text = unicodedata.normalize("NFKC", text)
 
     # Corriger mots collés par points
-    text = re.sub(r"([a-z])\.([A-Z])", r"\1. \2", text)
-    text = re.sub(r"([a-z])\.([a-z])", r"\1 \2", text)
+    text = _DOT_UPPER_RE.sub(r"\1. \2", text)
+    text = _DOT_LOWER_RE.sub(r"\1 \2", text)
 
     # Corrections OCR fréquentes
-    corrections = {
-        "tymph": "lymph",
-        "attendir g": "attending",
-        "alides": "slides",
-        "materiala": "materials",
-        "(D/": "(0/"
-    }
-    for wrong, right in corrections.items():
+    for wrong, right in CORRECTIONS.items():
         text = text.replace(wrong, right)
 
     # Supprimer points inutiles après chiffres ou majuscules avant unité
-    text = re.sub(r"(?<=\d)\.(?=\s*[a-zA-Z])", "", text)  # 5.5. cm → 5.5 cm
-    text = re.sub(r"\s*\.\s*(?=[a-z])", " ", text)        # "tumor. does" → "tumor does"
+    text = _DIGIT_DOT_RE.sub("", text)  # 5.5. cm → 5.5 cm
+    text = _DOT_BEFORE_LOWER_RE.sub(" ", text)        # "tumor. does" → "tumor does"
     
     # Supprimer points multiples
-    text = re.sub(r"\.{2,}", ".", text)
+    text = _MULTI_DOT_RE.sub(".", text)
 
     # Supprimer parenthèses vides
-    text = re.sub(r"\(\s*\)", "", text)
-    text = re.sub(r"\(\s*[\W_]+\s*\)", "", text)
+    text = _EMPTY_PARENS_RE.sub("", text)
+    text = _PUNCT_PARENS_RE.sub("", text)
 
     # Nettoyer retours ligne inutiles
-    text = re.sub(r"\s*\n\s*", " ", text)
+    text = _NEWLINE_RE.sub(" ", text)
 
     # Ajouter retours ligne avant sections clés
-    sections = [
-        "DIAGNOSIS",
-        "TISSUE DESCRIPTION",
-        "Comment",
-        "Key Pathological Findings",
-        "Specimen type",
-        "Clinical History",
-        "Preoperative Diagnosis",
-        "Gross Description",
-        "Intraoperative Consultation"
-    ]
-    for sec in sections:
-        text = re.sub(sec, f"\n\n{sec}", text, flags=re.I)
+    # préfiltre "in" sur le texte minuscule (ASCII seulement : re.I y équivaut à lower())
+    low = text.lower() if text.isascii() else None
+    for pat, repl, key in _SECTION_SUBS:
+        if low is None or key in low:
+            text = pat.sub(repl, text)
 
     # Espaces propres
-    text = re.sub(r"\s+", " ", text)
+    text = _WS_RE.sub(" ", text)
 
-    return text.strip()
\ No newline at end of file
+    return text.strip()
@@ -1,7 +1,10 @@
 # backend/embedding/dense.py
 import numpy as np
 import pandas as pd
+import torch
+from functools import lru_cache
 from pathlib import Path
+from typing import Union
 from sentence_transformers import SentenceTransformer
 
 
@@ -10,27 +13,15 @@ from sentence_transformers import SentenceTransformer
 # =========================
 CSV_PATH = Path("../../data/input/chunks/input_chunks.csv")
 OUT_DIR = Path("../../data/input/embeddings")
-OUT_DIR.mkdir(parents=True, exist_ok=True)
 
 TEXT_COL = "chunk_text"
 ID_COL = "chunk_id"
 
 # Dense model (high quality)
 DENSE_MODEL = "BAAI/bge-base-en-v1.5"  # ou: "intfloat/e5-base-v2"
-BATCH_SIZE = 64
-
-
-# =========================
-# LOAD + CLEAN
-# =========================
-df = pd.read_csv(CSV_PATH)
-
-# assurer que chunk_text existe
-if TEXT_COL not in df.columns:
-    raise ValueError(f"Missing column: {TEXT_COL}")
-
-df[TEXT_COL] = df[TEXT_COL].astype(str).fillna("")
-df = df[df[TEXT_COL].str.strip().ne("")].reset_index(drop=True)
+device = "cuda" if torch.cuda.is_available() else "cpu"
+# GPU: FP16 weights/activations (Tensor Cores) and larger batches to keep it busy
+BATCH_SIZE = 256 if device == "cuda" else 64
 
 # garder toutes les colonnes importantes pour payload + traçabilité
 META_COLS = [
@@ -52,37 +43,75 @@ META_COLS = [
     "is_admin_noise",
 ]
 
-missing = [c for c in META_COLS if c not in df.columns]
-if missing:
-    raise ValueError(f"Missing columns in CSV: {missing}")
 
-meta = df[META_COLS].copy()
-texts = df[TEXT_COL].tolist()
+# =========================
+# MODEL (chargé une seule fois par process)
+# =========================
+@lru_cache(maxsize=1)
+def _load_model() -> SentenceTransformer:
+    if device == "cuda":
+        return SentenceTransformer(DENSE_MODEL, device=device, model_kwargs={"torch_dtype": torch.float16})
+    return SentenceTransformer(DENSE_MODEL, device=device)
 
-print(f" Loaded chunks: {len(df)}")
 
+def encode(texts) -> np.ndarray:
+    """Normalized dense vectors, one row per text."""
+    return _load_model().encode(
+        texts,
+        batch_size=BATCH_SIZE,
+        show_progress_bar=True,
+        normalize_embeddings=True,  # recommandé avec COSINE
+    )
 
-# =========================
-# DENSE EMBEDDINGS
-# =========================
-model = SentenceTransformer(DENSE_MODEL)
 
-dense_vecs = model.encode(
-    texts,
-    batch_size=BATCH_SIZE,
-    show_progress_bar=True,
-    normalize_embeddings=True,  # recommandé avec COSINE
-)
+def run(src: Union[Path, pd.DataFrame] = CSV_PATH, out_dir: Path = OUT_DIR) -> None:
+    """`src` is the chunks CSV path, or the chunks DataFrame already in memory."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
 
-dense_vecs = dense_vecs.astype("float32")
+    # =========================
+    # LOAD + CLEAN
+    # =========================
+    df = src.copy() if isinstance(src, pd.DataFrame) else pd.read_csv(src)
 
+    # assurer que chunk_text existe
+    if TEXT_COL not in df.columns:
+        raise ValueError(f"Missing column: {TEXT_COL}")
+
+    df[TEXT_COL] = df[TEXT_COL].astype(str).fillna("")
+    df = df[df[TEXT_COL].str.strip().ne("")].reset_index(drop=True)
+
+    missing = [c for c in META_COLS if c not in df.columns]
+    if missing:
+        raise ValueError(f"Missing columns in CSV: {missing}")
+
+    meta = df[META_COLS].copy()
+
+    # textes identiques entre cas (templates) : on n'encode chaque texte qu'une fois
+    inv, uniq = pd.factorize(df[TEXT_COL], sort=False)
+    texts = uniq.tolist()
+
+    print(f" Loaded chunks: {len(df)} ({len(texts)} unique texts)")
+
+    # =========================
+    # DENSE EMBEDDINGS
+    # =========================
+    dense_vecs = np.take(encode(texts), inv, axis=0)
+
+    # stored as float16: normalized vectors keep cosine within ~1e-3 at half the bytes,
+    # and readers np.load(..., mmap_mode="r") it instead of pulling it all into RAM
+    dense_vecs = dense_vecs.astype("float16")
+
+    # =========================
+    # SAVE
+    # =========================
+    np.save(out_dir / "dense.npy", dense_vecs)
+    meta.to_parquet(out_dir / "meta.parquet", index=False)
+
+    print(" Dense saved:", out_dir / "dense.npy")
+    print(" Meta saved:", out_dir / "meta.parquet")
+    print("Dense shape:", dense_vecs.shape)
 
-# =========================
-# SAVE
-# =========================
-np.save(OUT_DIR / "dense.npy", dense_vecs)
-meta.to_parquet(OUT_DIR / "meta.parquet", index=False)
 
-print(" Dense saved:", OUT_DIR / "dense.npy")
-print(" Meta saved:", OUT_DIR / "meta.parquet")
-print("Dense shape:", dense_vecs.shape)
+if __name__ == "__main__":
+    run(CSV_PATH, OUT_DIR)
@@ -1,11 +1,12 @@
 # backend/embedding/rebuild_input_embeddings.py
-import sys
-import subprocess
 from pathlib import Path
 from typing import Dict, Any, List, Optional
 
+import numpy as np
 import pandas as pd
 
+from backend.embedding import dense, sparse
+
 
 PROJECT_ROOT = Path(__file__).resolve().parents[2]  # BIOCUP1
 CHUNKS_DIR = PROJECT_ROOT / "data" / "input" / "chunks"
@@ -36,24 +37,24 @@ REQUIRED_META_COLS = [
 ]
 
 
-def _flags_from_section(section: str) -> Dict[str, int]:
-    sec = (section or "GENERAL").upper()
+def _flags_from_sections(secs: np.ndarray) -> Dict[str, np.ndarray]:
+    """Section-derived flags for all chunks at once (int8 columns)."""
+    zeros = np.zeros(len(secs), dtype=np.int8)
     return {
-        "has_tnm": 0,
-        "has_size": 0,
-        "has_ihc": 1 if sec == "IHC" else 0,
-        "has_lymph": 1 if sec in ("LYMPH_NODES", "LYMPH") else 0,
-        "has_margins": 1 if sec == "MARGINS" else 0,
-        "has_tumor_size_cue": 1 if sec in ("SYNOPTIC", "DIAGNOSIS") else 0,
-        "is_admin_noise": 0,
+        "has_tnm": zeros,
+        "has_size": zeros,
+        "has_ihc": (secs == "IHC").astype(np.int8),
+        "has_lymph": np.isin(secs, ("LYMPH_NODES", "LYMPH")).astype(np.int8),
+        "has_margins": (secs == "MARGINS").astype(np.int8),
+        "has_tumor_size_cue": np.isin(secs, ("SYNOPTIC", "DIAGNOSIS")).astype(np.int8),
+        "is_admin_noise": zeros,
     }
 
 
-def write_input_chunks_csv(
+def build_input_chunks_df(
     sections: List[Dict[str, Any]],
-    out_csv: Optional[Path] = None,
     patient_id: str = "P_INPUT",
-) -> Path:
+) -> pd.DataFrame:
     """
     sections = [
       {"section": "DIAGNOSIS", "text": "..."},
@@ -61,35 +62,46 @@ def write_input_chunks_csv(
       ...
     ]
     """
-    out_csv = out_csv or (CHUNKS_DIR / "input_chunks.csv")
-
-    rows = []
+    idxs, secs, txts = [], [], []
     for idx, s in enumerate(sections):
-        sec = (s.get("section") or "GENERAL").upper()
         txt = str(s.get("chunk_text") or s.get("text") or "").strip()
         if not txt:
             continue
+        idxs.append(idx)
+        secs.append((s.get("section") or "GENERAL").upper())
+        txts.append(txt)
 
-        flags = _flags_from_section(sec)
-
-        rows.append({
-            "chunk_id": f"INPUT_{idx:04d}",
-            "case_id": "INPUT",
-            "primary_site": "unknown",
-            "tcga_type": "",
-            "patient_id": patient_id,
-            "section": sec,
-            "original_section": sec,
-            "chunk_index": idx,
-            "sub_index": 0,
-            **flags,
-            "chunk_text": txt,
-        })
-
-    if not rows:
+    if not txts:
         raise ValueError("No non-empty sections to write to input_chunks.csv")
 
-    df = pd.DataFrame(rows, columns=REQUIRED_META_COLS)
+    # built column-wise: no dict per row
+    secs = np.array(secs)
+    n = len(txts)
+    section = pd.Categorical(secs)
+    return pd.DataFrame({
+        "chunk_id": [f"INPUT_{i:04d}" for i in idxs],
+        "case_id": "INPUT",
+        "primary_site": "unknown",
+        "tcga_type": "",
+        "patient_id": patient_id,
+        "section": section,
+        "original_section": section,
+        "chunk_index": np.array(idxs, dtype=np.int64),
+        "sub_index": np.zeros(n, dtype=np.int8),
+        **_flags_from_sections(secs),
+        "chunk_text": txts,
+    }, columns=REQUIRED_META_COLS)
+
+
+def write_input_chunks_csv(
+    sections: List[Dict[str, Any]],
+    out_csv: Optional[Path] = None,
+    patient_id: str = "P_INPUT",
+    df: Optional[pd.DataFrame] = None,
+) -> Path:
+    out_csv = out_csv or (CHUNKS_DIR / "input_chunks.csv")
+    if df is None:
+        df = build_input_chunks_df(sections, patient_id=patient_id)
     df.to_csv(out_csv, index=False)
     return out_csv
 
@@ -99,21 +111,15 @@ def rebuild_embeddings_from_sections(
     patient_id: str = "P_INPUT",
 ) -> None:
     """
-    1) writes input_chunks.csv
-    2) runs dense.py then sparse.py (your existing scripts)
+    1) builds the chunks DataFrame and writes input_chunks.csv (snippets / validated upsert)
+    2) runs dense then sparse in this process on the in-memory DataFrame
+       (models stay loaded between rebuilds, the CSV is never read back)
     """
-    csv_path = write_input_chunks_csv(sections=sections, patient_id=patient_id)
+    df = build_input_chunks_df(sections, patient_id=patient_id)
+    csv_path = write_input_chunks_csv(sections=sections, patient_id=patient_id, df=df)
     print("✅ Wrote input chunks:", csv_path)
 
-    py = sys.executable  # current venv python
-    dense_py = PROJECT_ROOT / "backend" / "embedding" / "dense.py"
-    sparse_py = PROJECT_ROOT / "backend" / "embedding" / "sparse.py"
-
-    # Run scripts with PROJECT_ROOT as CWD so relative paths won't break
-    subprocess.run([py, str(dense_py)], check=True, cwd=str(dense_py.parent))
-    subprocess.run([py, str(sparse_py)], check=True, cwd=str(sparse_py.parent))
-
-    cwd=str(PROJECT_ROOT / "backend" / "embedding")
-
+    dense.run(df, EMB_DIR)
+    sparse.run(df, EMB_DIR)
 
     print("✅ Rebuilt embeddings in:", EMB_DIR)
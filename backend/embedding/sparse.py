@@ -2,7 +2,9 @@
 import numpy as np
 import pandas as pd
 import torch
+from functools import lru_cache
 from pathlib import Path
+from typing import Union
 from transformers import AutoTokenizer, AutoModelForMaskedLM
 
 
@@ -11,7 +13,6 @@ from transformers import AutoTokenizer, AutoModelForMaskedLM
 # =========================
 CSV_PATH = Path("../../data/input/chunks/input_chunks.csv")
 OUT_DIR = Path("../../data/input/embeddings")
-OUT_DIR.mkdir(parents=True, exist_ok=True)
 
 TEXT_COL = "chunk_text"
 
@@ -19,90 +20,151 @@ TEXT_COL = "chunk_text"
 SPLADE_MODEL = "prithivida/Splade_PP_en_v1"
 BATCH_SIZE = 16
 MAX_LENGTH = 128
+PAD_MULTIPLE = 16   # longueurs de batch possibles : 16, 32, ..., MAX_LENGTH
 TOPK = 256
 
 
-# =========================
-# LOAD + CLEAN
-# =========================
-df = pd.read_csv(CSV_PATH)
-
-if TEXT_COL not in df.columns:
-    raise ValueError(f"Missing column: {TEXT_COL}")
-
-df[TEXT_COL] = df[TEXT_COL].astype(str).fillna("")
-df = df[df[TEXT_COL].str.strip().ne("")].reset_index(drop=True)
-
-texts = df[TEXT_COL].tolist()
-
-print(f" Loaded chunks: {len(df)}")
+device = "cuda" if torch.cuda.is_available() else "cpu"
 
 
 # =========================
-# LOAD SPLADE
+# LOAD SPLADE (une seule fois par process)
 # =========================
-device = "cuda" if torch.cuda.is_available() else "cpu"
-tok = AutoTokenizer.from_pretrained(SPLADE_MODEL)
-splade = AutoModelForMaskedLM.from_pretrained(
-    SPLADE_MODEL,
-    use_safetensors=True
-).to(device).eval()
-
-
-
-@torch.no_grad()
+@lru_cache(maxsize=1)
+def _load_model():
+    tok = AutoTokenizer.from_pretrained(SPLADE_MODEL)
+    splade = AutoModelForMaskedLM.from_pretrained(
+        SPLADE_MODEL,
+        use_safetensors=True
+    ).to(device).eval()
+    if device == "cuda":
+        splade = splade.half()  # poids FP16 : moitié de la mémoire GPU
+        # graphe fixe appelé à chaque batch : Inductor + CUDA graphs (compilé au 1er batch
+        # de chaque longueur, d'où le padding à PAD_MULTIPLE)
+        if hasattr(torch, "compile"):
+            splade = torch.compile(splade, mode="reduce-overhead", dynamic=False)
+    return tok, splade
+
+
+@torch.inference_mode()
 def splade_encode(texts):
     """
     Retourne 2 listes (ragged):
       - indices[i] = array d'indices vocab (token ids) les plus importants pour le texte i
       - values[i]  = array de poids correspondants (float)
-    SPLADE: weights = max_{tokens}( log(1 + relu(logits)) )
+    SPLADE: weights = max_{tokens}( log(1 + relu(logits)) ) = log(1 + relu(max_{tokens} logits))
     """
-    all_indices = []
-    all_values = []
+    if not texts:
+        return [], []  # rien à encoder : run() écrit alors un CSR vide (indptr = [0])
+
+    tok, splade = _load_model()
+    all_indices = [None] * len(texts)
+    all_values = [None] * len(texts)
+
+    # tokenisé une seule fois (tokenizer Rust, en un appel) : sert au tri par longueur
+    # puis aux batches, qui ne font plus que du padding
+    feats = tok(texts, truncation=True, max_length=MAX_LENGTH)
+    # batches de longueurs proches : le padding=True ne gonfle plus tout le batch à MAX_LENGTH
+    order = np.argsort([len(x) for x in feats["input_ids"]], kind="stable")
+
+    def _collect(rows, vals, idx):
+        vals = vals.numpy()
+        idx = idx.numpy().astype(np.int32)
+        keep = vals > 0                             # indices non-nuls
+        for r, j in enumerate(rows):
+            all_indices[j] = idx[r][keep[r]]
+            all_values[j] = vals[r][keep[r]]
+
+    # GPU: D2H copy of batch N on its own stream into pinned memory, collected
+    # while batch N+1 runs, instead of a blocking .cpu() between batches
+    copy_stream = torch.cuda.Stream() if device == "cuda" else None
+    pending = None                                  # (rows, host vals, host idx, done event)
 
     for i in range(0, len(texts), BATCH_SIZE):
-        batch = texts[i:i + BATCH_SIZE]
+        rows = order[i:i + BATCH_SIZE]
 
-        enc = tok(
-            batch,
+        enc = tok.pad(
+            {k: [v[j] for j in rows] for k, v in feats.items()},
             padding=True,
-            truncation=True,
-            max_length=MAX_LENGTH,
+            pad_to_multiple_of=PAD_MULTIPLE,
             return_tensors="pt"
         ).to(device)
 
-        logits = splade(**enc).logits               # (B, L, V)
-        weights = torch.log1p(torch.relu(logits))   # (B, L, V)
-        weights = weights.max(dim=1).values         # (B, V)
+        # (B, L, V) with V≈30k is the biggest tensor here: FP16 activations on GPU
+        with torch.autocast(device_type=device, dtype=torch.float16, enabled=(device == "cuda")):
+            logits = splade(**enc).logits           # (B, L, V)
+            # log1p∘relu is monotonic: max over tokens first, so only a (B, V) buffer is built
+            weights = torch.log1p(torch.relu(logits.amax(dim=1)))   # (B, V)
+        weights = weights.float()
+
+        # top-k pour réduire la taille des sparse vectors : un seul kernel sur tout le batch
+        vals, idx = torch.topk(weights, k=min(TOPK, weights.shape[-1]), dim=-1)
+
+        if copy_stream is None:
+            _collect(rows, vals, idx)
+            continue
+
+        if pending is not None:
+            pending[3].synchronize()
+            _collect(*pending[:3])
+
+        copy_stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(copy_stream):
+            h_vals = torch.empty(vals.shape, dtype=vals.dtype, pin_memory=True)
+            h_idx = torch.empty(idx.shape, dtype=idx.dtype, pin_memory=True)
+            h_vals.copy_(vals, non_blocking=True)
+            h_idx.copy_(idx, non_blocking=True)
+            vals.record_stream(copy_stream)
+            idx.record_stream(copy_stream)
+            done = torch.cuda.Event()
+            done.record(copy_stream)
+        pending = (rows, h_vals, h_idx, done)
+
+    if pending is not None:
+        pending[3].synchronize()
+        _collect(*pending[:3])
 
-        weights = weights.cpu()
+    return all_indices, all_values
 
-        for w in weights:
-            nz = torch.nonzero(w).squeeze(-1)   # indices non-nuls
-            vals = w[nz]
 
-            # top-k pour réduire la taille des sparse vectors
-            if nz.numel() > TOPK:
-                vals, idx = torch.topk(vals, k=TOPK)
-                nz = nz[idx]
+def run(src: Union[Path, pd.DataFrame] = CSV_PATH, out_dir: Path = OUT_DIR) -> None:
+    """`src` is the chunks CSV path, or the chunks DataFrame already in memory."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
 
-            all_indices.append(nz.numpy().astype(np.int32))
-            all_values.append(vals.numpy().astype(np.float32))
+    # =========================
+    # LOAD + CLEAN
+    # =========================
+    df = src.copy() if isinstance(src, pd.DataFrame) else pd.read_csv(src)
 
-    return all_indices, all_values
+    if TEXT_COL not in df.columns:
+        raise ValueError(f"Missing column: {TEXT_COL}")
 
+    df[TEXT_COL] = df[TEXT_COL].astype(str).fillna("")
+    df = df[df[TEXT_COL].str.strip().ne("")].reset_index(drop=True)
 
-indices, values = splade_encode(texts)
+    texts = df[TEXT_COL].tolist()
 
-# =========================
-# SAVE (ragged arrays)
-# =========================
-np.savez_compressed(
-    OUT_DIR / "sparse_splade.npz",
-    indices=np.array(indices, dtype=object),
-    values=np.array(values, dtype=object),
-)
-
-print(" Sparse saved:", OUT_DIR / "sparse_splade.npz")
-print("Chunks:", len(indices))
+    print(f" Loaded chunks: {len(df)}")
+
+    indices, values = splade_encode(texts)
+
+    # =========================
+    # SAVE (CSR : indptr[N+1] + indices/values concaténés, sans pickle)
+    # =========================
+    indptr = np.zeros(len(indices) + 1, dtype=np.int64)
+    np.cumsum([len(a) for a in indices], out=indptr[1:])
+    np.savez_compressed(
+        out_dir / "sparse_splade.npz",
+        indptr=indptr,
+        indices=np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32),
+        # poids post-log1p stockés en float16 : ~3 décimales, bien sous le bruit du score lexical
+        values=(np.concatenate(values) if values else np.zeros(0)).astype(np.float16),
+    )
+
+    print(" Sparse saved:", out_dir / "sparse_splade.npz")
+    print("Chunks:", len(indices))
+
+
+if __name__ == "__main__":
+    run(CSV_PATH, OUT_DIR)
@@ -23,7 +23,10 @@ if not client.collection_exists(COLLECTION):
         sparse_vectors_config={     # pour les termes exactes
             "sparse": qm.SparseVectorParams(modifier=qm.Modifier.IDF)  # IDF côté serveur :contentReference[oaicite:6]{index=6}
         },
-        hnsw_config=qm.HnswConfigDiff(m=16, ef_construct=256),
+        hnsw_config=qm.HnswConfigDiff(m=16, ef_construct=256, on_disk=False),  # graphe HNSW en RAM
+        quantization_config=qm.ScalarQuantization(   # int8 en RAM : 4x moins de trafic mémoire
+            scalar=qm.ScalarQuantizationConfig(type=qm.ScalarType.INT8, always_ram=True)
+        ),
         optimizers_config=qm.OptimizersConfigDiff(indexing_threshold=20000),
     )
     print("✅ Created collection:", COLLECTION)
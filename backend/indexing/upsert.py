@@ -1,13 +1,16 @@
 # backend/qdrant/upsert.py
 
 import os
-import uuid
+import mmap
+import asyncio
+import hashlib
 import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 from pathlib import Path
 from dotenv import load_dotenv
 
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient
 from qdrant_client.http import models as qm
 
 
@@ -24,38 +27,53 @@ DENSE_PATH = EMB_DIR / "dense.npy"
 SPARSE_PATH = EMB_DIR / "sparse_splade.npz"
 
 BATCH_SIZE = 128
+MAX_IN_FLIGHT = 6   # batches envoyés en parallèle (le RTT réseau domine)
+# gRPC : vecteurs envoyés en floats packés au lieu de JSON (QDRANT_PREFER_GRPC=0 pour REST)
+PREFER_GRPC = os.environ.get("QDRANT_PREFER_GRPC", "1") != "0"
 
 
 # =========================
 # QDRANT CLIENT
 # =========================
-client = QdrantClient(
+client = AsyncQdrantClient(
     url=os.environ["QDRANT_URL"],
     api_key=os.environ.get("QDRANT_API_KEY"),
+    prefer_grpc=PREFER_GRPC,
 )
 
 
 # =========================
 # UTILS
 # =========================
-def stable_uuid(text: str) -> str:
-    """UUID stable et valide pour Qdrant"""
-    return str(uuid.uuid5(uuid.NAMESPACE_URL, text))
-
-
-def payload_safe(d: dict) -> dict:
-    """Convertit NaN → None + types JSON-safe"""
-    out = {}
-    for k, v in d.items():
-        if pd.isna(v):
-            out[k] = None
-        elif isinstance(v, (np.integer,)):
-            out[k] = int(v)
-        elif isinstance(v, (np.floating,)):
-            out[k] = float(v)
-        else:
-            out[k] = v
-    return out
+def stable_id(text: str) -> int:
+    """ID entier stable (64 bits, BLAKE2b) valide pour Qdrant, plus léger qu'un UUID
+
+    ⚠️ Une collection indexée avec les anciens IDs uuid5 doit être supprimée puis
+    recréée (create_collection.py) avant de relancer cet upsert, sinon chaque chunk
+    y existe deux fois. Les chunk_id ayant changé (fingerprint 5 octets), les uuid5
+    auraient de toute façon tous changé.
+    """
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big") & ((1 << 63) - 1)
+
+
+def load_npy_mmap(path: Path) -> np.ndarray:
+    """Mappe un .npy en lecture seule via mmap.mmap (rangées lues dans l'ordre : readahead séquentiel)"""
+    with open(path, "rb") as f:
+        version = np.lib.format.read_magic(f)
+        read_header = (np.lib.format.read_array_header_1_0 if version == (1, 0)
+                       else np.lib.format.read_array_header_2_0)
+        shape, fortran, dtype = read_header(f)
+        offset = f.tell()
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mm, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+    arr = np.frombuffer(mm, dtype=dtype, count=int(np.prod(shape)), offset=offset)
+    return arr.reshape(shape, order="F" if fortran else "C")
+
+
+def payload_records(df: pd.DataFrame) -> list:
+    """Convertit NaN → None + types JSON-safe, pour tout le DataFrame en une passe"""
+    return df.astype(object).where(pd.notna(df), None).to_dict(orient="records")
 
 
 # =========================
@@ -63,15 +81,16 @@ def payload_safe(d: dict) -> dict:
 # =========================
 print("📥 Loading data...")
 
-meta = pd.read_parquet(META_PATH)
-dense = np.load(DENSE_PATH)
-sp = np.load(SPARSE_PATH, allow_pickle=True)
-sp_indices = sp["indices"]
-sp_values = sp["values"]
+# meta is streamed batch by batch (iter_batches) in upsert_all, never fully in RAM
+meta_file = pq.ParquetFile(META_PATH)
+dense = load_npy_mmap(DENSE_PATH)
+sp = np.load(SPARSE_PATH)
+# CSR: row i = indices/values[indptr[i]:indptr[i + 1]]
+sp_indptr, sp_indices, sp_values = sp["indptr"], sp["indices"], sp["values"]
 
-N = len(meta)
+N = meta_file.metadata.num_rows
 
-assert dense.shape[0] == N == len(sp_indices) == len(sp_values), "❌ Data misalignment"
+assert dense.shape[0] == N == len(sp_indptr) - 1, "❌ Data misalignment"
 
 print(f"✅ Loaded {N} points")
 
@@ -81,35 +100,65 @@ print(f"✅ Loaded {N} points")
 # =========================
 print("🚀 Upserting into Qdrant...")
 
-for start in range(0, N, BATCH_SIZE):
-    end = min(start + BATCH_SIZE, N)
+def build_points(start: int, meta_batch: pd.DataFrame) -> list:
     points = []
+    end = start + len(meta_batch)
+    payloads = payload_records(meta_batch)
+    # one C-level conversion for the whole batch instead of one per point
+    dense_rows = dense[start:end].astype(np.float32).tolist()
 
     for i in range(start, end):
-        row = meta.iloc[i]
-        raw_id = str(row["chunk_id"])
-        pid = stable_uuid(raw_id)
+        payload = payloads[i - start]
+        raw_id = str(payload["chunk_id"])
+        pid = stable_id(raw_id)
 
+        lo, hi = sp_indptr[i], sp_indptr[i + 1]
         sv = qm.SparseVector(
-            indices=sp_indices[i].tolist(),
-            values=sp_values[i].tolist(),
+            indices=sp_indices[lo:hi].tolist(),
+            values=sp_values[lo:hi].tolist(),
         )
 
-        payload = payload_safe(row.to_dict())
         payload["chunk_id_raw"] = raw_id  # traçabilité
 
         points.append(
             qm.PointStruct(
                 id=pid,
                 vector={
-                    "dense": dense[i].tolist(),
+                    "dense": dense_rows[i - start],
                     "sparse": sv,
                 },
                 payload=payload,
             )
         )
 
-    client.upsert(collection_name=COLLECTION, points=points)
-    print(f"✅ Upserted {end}/{N}")
+    return points
+
+
+async def upsert_all() -> None:
+    # au plus MAX_IN_FLIGHT batches construits / en vol : le batch suivant se construit
+    # pendant que les précédents attendent la réponse de Qdrant
+    sem = asyncio.Semaphore(MAX_IN_FLIGHT)
+
+    async def send(points, end):
+        try:
+            await client.upsert(collection_name=COLLECTION, points=points)
+        finally:
+            sem.release()
+        print(f"✅ Upserted batch ending at {end}/{N}")
+
+    tasks = []
+    try:
+        start = 0
+        for rb in meta_file.iter_batches(batch_size=BATCH_SIZE):
+            await sem.acquire()
+            end = start + rb.num_rows
+            tasks.append(asyncio.create_task(send(build_points(start, rb.to_pandas()), end)))
+            start = end
+        await asyncio.gather(*tasks)
+    finally:
+        await client.close()
+
+
+asyncio.run(upsert_all())
 
 print("🎉 DONE — All points uploaded to Qdrant")
@@ -0,0 +1,36 @@
+# backend/search/_openai.py
+# ============================================================
+# BioCUP — one shared OpenAI client per process
+# ============================================================
+# explain / diagnostic_refine both call the OpenAI API: a single client keeps
+# its httpx pool (TCP/TLS connections) alive across calls instead of one per
+# module.
+
+import os
+import threading
+
+_CLIENT = None
+_LOCK = threading.Lock()
+
+
+def get_openai():
+    """Lazily built so that callers have loaded .env first (and openai stays optional until then)."""
+    global _CLIENT
+    if _CLIENT is None:
+        with _LOCK:  # the LLM calls run from worker threads
+            if _CLIENT is None:
+                import httpx
+                from openai import OpenAI
+
+                api_key = os.environ.get("OPENAI_API_KEY")
+                if not api_key:
+                    raise RuntimeError("Missing OPENAI_API_KEY in .env (project root)")
+                _CLIENT = OpenAI(
+                    api_key=api_key,
+                    max_retries=3,  # transient 429/5xx retried by the SDK
+                    http_client=httpx.Client(
+                        limits=httpx.Limits(max_keepalive_connections=8, max_connections=16),
+                        timeout=60.0,
+                    ),
+                )
+    return _CLIENT
@@ -0,0 +1,44 @@
+# backend/search/_qdrant.py
+# ============================================================
+# BioCUP — one shared Qdrant client per process
+# ============================================================
+# search / search_final / explain / diagnostic_refine all talk to the same
+# Qdrant: a single client keeps its connection (gRPC channel or HTTP pool)
+# alive across predict_primary_site() calls instead of one per module.
+
+import os
+import threading
+
+from qdrant_client import QdrantClient
+from qdrant_client.http import models as qm
+
+_CLIENT = None
+_LOCK = threading.Lock()
+
+# dense leg of the hybrid queries (search / search_final) on the int8-quantized
+# collection: HNSW ef = limit (K_DENSE = 80 in both; Qdrant never explores fewer
+# than `limit` candidates anyway), 2x oversampling, then rescored with the original
+# vectors (keeps recall of the float search). The sparse leg uses the inverted
+# index: no HNSW params there.
+DENSE_SEARCH_PARAMS = qm.SearchParams(
+    hnsw_ef=80,
+    exact=False,
+    quantization=qm.QuantizationSearchParams(rescore=True, oversampling=2.0),
+)
+
+
+def get_qdrant() -> QdrantClient:
+    """Lazily built so that callers have loaded .env first."""
+    global _CLIENT
+    if _CLIENT is None:
+        with _LOCK:
+            if _CLIENT is None:
+                _CLIENT = QdrantClient(
+                    url=os.environ["QDRANT_URL"],
+                    api_key=os.environ.get("QDRANT_API_KEY"),
+                    # gRPC: persistent multiplexed channel + binary framing (QDRANT_PREFER_GRPC=0 pour REST)
+                    prefer_grpc=os.environ.get("QDRANT_PREFER_GRPC", "1") != "0",
+                    timeout=10,
+                    grpc_options={"grpc.keepalive_time_ms": 30000},
+                )
+    return _CLIENT
@@ -5,13 +5,19 @@
 
 import os
 import sys
+import copy
 import json
 import uuid
+import hashlib
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 
 from dotenv import load_dotenv
-from qdrant_client import QdrantClient
+from qdrant_client.http.exceptions import UnexpectedResponse
 
 # -------------------------
 # Path + env bootstrap FIRST
@@ -26,22 +32,48 @@ load_dotenv(dotenv_path=Path(".") / ".env", override=True)
 
 COLLECTION = os.getenv("COLLECTION_NAME", "biocup_hybrid_splade_v1")
 
-qdrant = QdrantClient(
-    url=os.environ["QDRANT_URL"],
-    api_key=os.environ.get("QDRANT_API_KEY"),
-)
-
 # -------------------------
 # Internal imports (after sys.path setup)
 # -------------------------
 from backend.search.search_final import predict_primary_site
+from backend.search.evidence_context import build_context_from_evidence
 from backend.embedding.rebuild_input_embeddings import rebuild_embeddings_from_sections
 from backend.search.qdrant_upsert_validated import upsert_validated_input_case
+from backend.search._qdrant import get_qdrant
+from backend.search._openai import get_openai
+
+qdrant = get_qdrant()
 
 
 # -------------------------
 # Build a structured report like your dataset
 # -------------------------
+# (section, update keys (lowercase, by priority), text prefix)
+SECTION_TEMPLATES = [
+    ("DIAGNOSIS", ("diagnosis",), "Diagnosis / pathology impression:"),
+    ("IHC", ("ihc",), "IHC results:"),
+    ("GENERAL", ("imaging",), "Imaging findings:"),
+    ("GENERAL", ("labs", "tumor_markers", "tumormarkers"), "Laboratory / tumor markers:"),
+]
+
+# every section dict carries the same keys (one shape for all of them)
+_DEFAULT_FLAGS: Dict[str, Any] = {
+    **dict.fromkeys(("has_ihc", "has_lymph", "has_margins", "has_tnm", "has_size"), False),
+    "is_admin_noise": 0,
+}
+
+# update keys already turned into a section above (not repeated in the COMMENT note)
+_KNOWN_KEYS = frozenset(k.upper() for _, keys, _ in SECTION_TEMPLATES for k in keys)
+
+
+def _stringify_update(v: Any) -> str:
+    if v is None:
+        return ""
+    if isinstance(v, (list, tuple)):
+        return ", ".join(map(str, v))
+    return str(v)
+
+
 def build_patient_sections(
     patient_summary: str,
     doctor_updates: Optional[Dict[str, Any]] = None,
@@ -52,13 +84,25 @@ def build_patient_sections(
     """
     updates = doctor_updates or {}
 
-    def _get(key: str) -> str:
-        v = updates.get(key)
-        if v is None:
-            return ""
-        if isinstance(v, (list, tuple)):
-            return ", ".join(map(str, v))
-        return str(v)
+    # one pass over the updates:
+    # - template keys -> case-insensitive view, first non-empty value per lowercased key
+    #   (KEY before key before Key when several spellings are given)
+    # - anything else -> COMMENT note lines, in the doctor's order
+    ci: Dict[str, str] = {}
+    rank: Dict[str, int] = {}
+    other_lines = []
+    for k, v in updates.items():
+        if k.upper() not in _KNOWN_KEYS:
+            if v is not None and v != "" and v != []:
+                other_lines.append(f"- {k}: {v}")
+            continue
+        sv = _stringify_update(v)
+        if not sv.strip():
+            continue
+        kl = k.lower()
+        r = 0 if k.isupper() else 1 if k.islower() else 2
+        if r < rank.get(kl, 3):
+            ci[kl], rank[kl] = sv, r
 
     sections: List[Dict[str, Any]] = []
 
@@ -67,68 +111,27 @@ def build_patient_sections(
         "section": "GENERAL",
         "chunk_index": 0,
         "chunk_text": patient_summary.strip(),
-        "has_ihc": False,
-        "has_lymph": False,
-        "has_margins": False,
-        "has_tnm": False,
-        "has_size": False,
-        "is_admin_noise": 0,
+        **_DEFAULT_FLAGS,
     })
 
-    # DIAGNOSIS-like
-    diag = _get("DIAGNOSIS") or _get("diagnosis") or ""
-    if diag.strip():
-        sections.append({
-            "section": "DIAGNOSIS",
-            "chunk_index": len(sections),
-            "chunk_text": f"Diagnosis / pathology impression:\n{diag.strip()}",
-            "is_admin_noise": 0,
-        })
-
-    # IHC
-    ihc = _get("IHC") or _get("ihc") or ""
-    if ihc.strip():
-        sections.append({
-            "section": "IHC",
-            "chunk_index": len(sections),
-            "chunk_text": f"IHC results:\n{ihc.strip()}",
-            "is_admin_noise": 0,
-        })
-
-    # IMAGING
-    imaging = _get("IMAGING") or _get("imaging") or _get("Imaging") or ""
-    if imaging.strip():
-        sections.append({
-            "section": "GENERAL",
-            "chunk_index": len(sections),
-            "chunk_text": f"Imaging findings:\n{imaging.strip()}",
-            "is_admin_noise": 0,
-        })
-
-    # LABS / TUMOR MARKERS
-    labs = _get("LABS") or _get("tumor_markers") or _get("TumorMarkers") or ""
-    if labs.strip():
-        sections.append({
-            "section": "GENERAL",
-            "chunk_index": len(sections),
-            "chunk_text": f"Laboratory / tumor markers:\n{labs.strip()}",
-            "is_admin_noise": 0,
-        })
+    # DIAGNOSIS-like / IHC / IMAGING / LABS / TUMOR MARKERS
+    for section, keys, prefix in SECTION_TEMPLATES:
+        text = next((ci[k] for k in keys if k in ci), "")
+        if text:
+            sections.append({
+                "section": section,
+                "chunk_index": len(sections),
+                "chunk_text": f"{prefix}\n{text.strip()}",
+                **_DEFAULT_FLAGS,
+            })
 
     # Extra updates as a compact note
-    other_lines = []
-    for k, v in updates.items():
-        if k.upper() in {"DIAGNOSIS", "IHC", "IMAGING", "LABS", "TUMORMARKERS"}:
-            continue
-        if v is None or v == "" or v == []:
-            continue
-        other_lines.append(f"- {k}: {v}")
     if other_lines:
         sections.append({
             "section": "COMMENT",
             "chunk_index": len(sections),
             "chunk_text": "Doctor-provided updates:\n" + "\n".join(other_lines),
-            "is_admin_noise": 0,
+            **_DEFAULT_FLAGS,
         })
 
     return sections
@@ -137,35 +140,15 @@ def build_patient_sections(
 # -------------------------
 # Evidence/context for LLM
 # -------------------------
-def build_context_from_evidence(
-    evidence_by_site: dict,
-    top_sites: list,
-    max_items_per_site: int = 6,
-    max_chars: int = 6000,
-) -> str:
-    blocks = []
-    total = 0
-
-    for site in top_sites:
-        blocks.append(f"\n### SITE: {site}\n")
-        for e in evidence_by_site.get(site, [])[:max_items_per_site]:
-            case_id = e.get("case_id")
-            sec = e.get("section")
-            score = e.get("score")
-            snippet = (e.get("snippet") or "").strip()
-
-            block = (
-                f"(case_id={case_id}, section={sec}, score={float(score):.4f})\n"
-                f"{snippet}\n"
-            )
-            blocks.append(block)
-            total += len(block)
-            if total >= max_chars:
-                break
-        if total >= max_chars:
-            break
-
-    return "\n".join(blocks)
+# (predicate(margin_12, sites, evidence), reason) — checked in order
+_UNCERTAINTY_RULES = (
+    (lambda m, sites, ev: m is not None and m < 5.0,
+     "Top-1 vs Top-2 margin is small (close match)."),
+    (lambda m, sites, ev: len(sites) >= 3,
+     "Multiple sites appear plausible based on retrieved evidence."),
+    (lambda m, sites, ev: not ev,
+     "No evidence snippets were returned (missing payload/snippets)."),
+)
 
 
 def summarize_uncertainty(dbg: Dict[str, Any], top_k: int = 3) -> Dict[str, Any]:
@@ -177,13 +160,8 @@ def summarize_uncertainty(dbg: Dict[str, Any], top_k: int = 3) -> Dict[str, Any]
     if len(sorted_sites) >= 2:
         margin_12 = float(sorted_sites[0][1]) - float(sorted_sites[1][1])
 
-    reasons = []
-    if margin_12 is not None and margin_12 < 5.0:
-        reasons.append("Top-1 vs Top-2 margin is small (close match).")
-    if len(sites) >= 3:
-        reasons.append("Multiple sites appear plausible based on retrieved evidence.")
-    if not dbg.get("evidence"):
-        reasons.append("No evidence snippets were returned (missing payload/snippets).")
+    evidence = dbg.get("evidence")
+    reasons = [msg for pred, msg in _UNCERTAINTY_RULES if pred(margin_12, sites, evidence)]
 
     return {
         "top_sites": sites,
@@ -194,19 +172,42 @@ def summarize_uncertainty(dbg: Dict[str, Any], top_k: int = 3) -> Dict[str, Any]
 
 
 # -------------------------
-# OpenAI calls
+# OpenAI calls (client shared with explain: backend/search/_openai.py)
 # -------------------------
-def _openai_client():
-    from openai import OpenAI
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("Missing OPENAI_API_KEY in .env (project root)")
-    return OpenAI(api_key=api_key)
+class _RateLimiter:
+    """Token bucket shared by all threads: at most `rpm` OpenAI requests per minute (0 = off)."""
 
+    def __init__(self, rpm: int):
+        self.rpm = rpm
+        self._tokens = float(rpm)
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
 
-def explain_top_site_with_llm(question: str, dbg: Dict[str, Any], top_k: int = 3) -> str:
-    client_oa = _openai_client()
+    def acquire(self) -> None:
+        if self.rpm <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.rpm, self._tokens + (now - self._stamp) * self.rpm / 60.0)
+                self._stamp = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) * 60.0 / self.rpm
+            time.sleep(wait)
 
+
+_LLM_LIMITER = _RateLimiter(int(os.getenv("OPENAI_RPM", "0")))
+
+
+def _llm_json(payload: Dict[str, Any]) -> str:
+    # compact separators: no padding spaces in the (token-billed) prompt body
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+def _site_stats(dbg: Dict[str, Any], top_k: int = 3):
+    """(top_sites, site_stats, margin_top1_top2) shared by the explanation prompts."""
     sorted_sites = dbg.get("sorted_sites", [])[:top_k]
     top_sites = [s for s, _ in sorted_sites]
 
@@ -216,20 +217,88 @@ def explain_top_site_with_llm(question: str, dbg: Dict[str, Any], top_k: int = 3
 
     for s in top_sites:
         ev = evidence.get(s, []) or []
-        best = max([float(e.get("score", 0.0)) for e in ev], default=0.0)
+        # one pass per evidence item for both the best score and the sections
+        best = 0.0 if not ev else float("-inf")
+        sections = set()
+        for e in ev:
+            sc = float(e.get("score", 0.0))
+            if sc > best:
+                best = sc
+            sec = e.get("section")
+            if sec:
+                sections.add(str(sec))
         site_stats[s] = {
             "pct": float(pct_map.get(s, 0.0)),
             "evidence_count": len(ev),
             "best_evidence_score": best,
-            "sections_present": sorted({str(e.get("section")) for e in ev if e.get("section")}),
+            "sections_present": sorted(sections),
         }
 
     margin_12 = None
     if len(sorted_sites) >= 2:
         margin_12 = float(sorted_sites[0][1]) - float(sorted_sites[1][1])
 
+    return top_sites, site_stats, margin_12
+
+
+_EXPLAIN_RULES = (
+    "- Use ONLY the provided context and numeric site_stats.\n"
+    "- Do NOT invent facts.\n"
+    "- Only mention sections that appear in the evidence context.\n"
+    "- Provide citations as (case_id, section) for every evidence bullet.\n"
+    "- If >=3 evidence items exist for top-1, cite at least 3.\n"
+    "- If margin_top1_top2 < 5%, explicitly state uncertainty is high.\n"
+    "- Do NOT give medical advice.\n"
+)
+
+_EXPLAIN_FORMAT = [
+    "1) Top-site reasoning (short, must align with site_stats)",
+    "2) Top-1 vs Top-2 evidence bullets (each bullet must end with (case_id, section))",
+    "3) Top-1 vs Top-3 evidence bullets (each bullet must end with (case_id, section))",
+    "4) Generic/weak evidence to ignore (bullets)",
+    "5) Conclusion + explicit uncertainty note (use margin)",
+]
+
+_TESTS_RULES = (
+    "- Be conservative and generic.\n"
+    "- Use ONLY the provided patient summary + evidence context + uncertainty reasons.\n"
+    "- If evidence is insufficient, request what is missing.\n"
+    "- Do not give medical advice or treatment.\n"
+)
+
+_TESTS_SCHEMA = {
+    "questions_to_clarify": [
+        {"field": "...", "question": "...", "type": "text|single_select|multi_select", "options": []}
+    ],
+    "recommended_investigations": [
+        {
+            "category": "Imaging|IHC|PathologyDetail|ClinicalPattern|Lab",
+            "item": "...",
+            "rationale": "...",
+            "expected_answer_type": "text|boolean|single_select",
+            "options": [],
+        }
+    ],
+    "rerank_strategy": {"how_to_use_new_info": ["...short bullets..."]},
+}
+
+
+def _tests_fallback(raw: str) -> Dict[str, Any]:
+    return {
+        "questions_to_clarify": [],
+        "recommended_investigations": [],
+        "rerank_strategy": {"how_to_use_new_info": ["LLM returned non-JSON; check raw_text."]},
+        "raw_text": raw,
+    }
+
+
+def explain_top_site_with_llm(question: str, dbg: Dict[str, Any], top_k: int = 3) -> str:
+    client_oa = get_openai()
+
+    top_sites, site_stats, margin_12 = _site_stats(dbg, top_k)
+
     context = build_context_from_evidence(
-        evidence_by_site=evidence,
+        evidence_by_site=dbg.get("evidence", {}),
         top_sites=top_sites,
         max_items_per_site=6,
         max_chars=6000,
@@ -238,13 +307,7 @@ def explain_top_site_with_llm(question: str, dbg: Dict[str, Any], top_k: int = 3
     system = (
         "You are a clinical retrieval assistant for BioCUP.\n"
         "Rules:\n"
-        "- Use ONLY the provided context and numeric site_stats.\n"
-        "- Do NOT invent facts.\n"
-        "- Only mention sections that appear in the evidence context.\n"
-        "- Provide citations as (case_id, section) for every evidence bullet.\n"
-        "- If >=3 evidence items exist for top-1, cite at least 3.\n"
-        "- If margin_top1_top2 < 5%, explicitly state uncertainty is high.\n"
-        "- Do NOT give medical advice.\n"
+        + _EXPLAIN_RULES
     )
 
     user_payload = {
@@ -252,21 +315,16 @@ def explain_top_site_with_llm(question: str, dbg: Dict[str, Any], top_k: int = 3
         "margin_top1_top2_pct": margin_12,
         "site_stats": site_stats,
         "context": context,
-        "required_format": [
-            "1) Top-site reasoning (short, must align with site_stats)",
-            "2) Top-1 vs Top-2 evidence bullets (each bullet must end with (case_id, section))",
-            "3) Top-1 vs Top-3 evidence bullets (each bullet must end with (case_id, section))",
-            "4) Generic/weak evidence to ignore (bullets)",
-            "5) Conclusion + explicit uncertainty note (use margin)",
-        ],
+        "required_format": _EXPLAIN_FORMAT,
     }
 
+    _LLM_LIMITER.acquire()
     resp = client_oa.chat.completions.create(
         model=os.getenv("LLM_MODEL", "gpt-4o-mini"),
         temperature=0.0,
         messages=[
             {"role": "system", "content": system},
-            {"role": "user", "content": json.dumps(user_payload, ensure_ascii=False)},
+            {"role": "user", "content": _llm_json(user_payload)},
         ],
     )
     return resp.choices[0].message.content
@@ -292,11 +350,8 @@ def propose_tests_with_llm(
         "You are NOT diagnosing.\n"
         "Your role: suggest additional information/tests that could reduce uncertainty in retrieval.\n"
         "Rules:\n"
-        "- Be conservative and generic.\n"
-        "- Use ONLY the provided patient summary + evidence context + uncertainty reasons.\n"
-        "- If evidence is insufficient, request what is missing.\n"
-        "- Do not give medical advice or treatment.\n"
-        "- Output JSON only, no markdown.\n"
+        + _TESTS_RULES
+        + "- Output JSON only, no markdown.\n"
     )
 
     payload = {
@@ -304,30 +359,17 @@ def propose_tests_with_llm(
         "top_retrieved_sites": top_sites,
         "uncertainty": uncertainty,
         "evidence_context": context,
-        "output_schema": {
-            "questions_to_clarify": [
-                {"field": "...", "question": "...", "type": "text|single_select|multi_select", "options": []}
-            ],
-            "recommended_investigations": [
-                {
-                    "category": "Imaging|IHC|PathologyDetail|ClinicalPattern|Lab",
-                    "item": "...",
-                    "rationale": "...",
-                    "expected_answer_type": "text|boolean|single_select",
-                    "options": [],
-                }
-            ],
-            "rerank_strategy": {"how_to_use_new_info": ["...short bullets..."]},
-        },
+        "output_schema": _TESTS_SCHEMA,
     }
 
-    client_oa = _openai_client()
+    client_oa = get_openai()
+    _LLM_LIMITER.acquire()
     resp = client_oa.chat.completions.create(
         model=os.getenv("LLM_MODEL", "gpt-4o-mini"),
         temperature=0.0,
         messages=[
             {"role": "system", "content": system},
-            {"role": "user", "content": json.dumps(payload, ensure_ascii=False)},
+            {"role": "user", "content": _llm_json(payload)},
         ],
     )
 
@@ -335,17 +377,173 @@ def propose_tests_with_llm(
     try:
         return json.loads(raw)
     except json.JSONDecodeError:
-        return {
-            "questions_to_clarify": [],
-            "recommended_investigations": [],
-            "rerank_strategy": {"how_to_use_new_info": ["LLM returned non-JSON; check raw_text."]},
-            "raw_text": raw,
-        }
+        return _tests_fallback(raw)
+
+
+def _explain_and_propose_body(
+    question: str,
+    patient_summary: str,
+    dbg: Dict[str, Any],
+    top_k: int = 3,
+) -> Dict[str, Any]:
+    """chat.completions request body of explain_and_propose_with_llm (also used by the Batch API)."""
+    top_sites, site_stats, margin_12 = _site_stats(dbg, top_k)
+    uncertainty = summarize_uncertainty(dbg, top_k=top_k)
+
+    context = build_context_from_evidence(
+        dbg.get("evidence", {}),
+        top_sites=top_sites,
+        max_items_per_site=6,
+        max_chars=6000,
+    )
+
+    system = (
+        "You are a clinical retrieval and decision-support assistant for BioCUP "
+        "(Cancer of Unknown Primary). You are NOT diagnosing.\n"
+        "Do two tasks on the same inputs.\n"
+        "task1 (explanation) rules:\n"
+        + _EXPLAIN_RULES
+        + "task2 (diagnostic_refinement): suggest additional information/tests that could reduce "
+        "uncertainty in retrieval. Rules:\n"
+        + _TESTS_RULES
+        + "Output one JSON object: {\"explanation\": <task1 text following task1.required_format>, "
+        "\"diagnostic_refinement\": <object following task2.output_schema>}.\n"
+    )
+
+    payload = {
+        "patient_summary": patient_summary,
+        "margin_top1_top2_pct": margin_12,
+        "site_stats": site_stats,
+        "uncertainty": uncertainty,
+        "context": context,
+        "task1": {"question": question, "required_format": _EXPLAIN_FORMAT},
+        "task2": {"top_retrieved_sites": top_sites, "output_schema": _TESTS_SCHEMA},
+    }
+
+    return {
+        "model": os.getenv("LLM_MODEL", "gpt-4o-mini"),
+        "temperature": 0.0,
+        "response_format": {"type": "json_object"},
+        "messages": [
+            {"role": "system", "content": system},
+            {"role": "user", "content": _llm_json(payload)},
+        ],
+    }
+
+
+def _parse_explain_and_propose(raw: str) -> Tuple[str, Dict[str, Any]]:
+    raw = raw.strip()
+    try:
+        out = json.loads(raw)
+    except json.JSONDecodeError:
+        return raw, _tests_fallback(raw)
+
+    tests_plan = out.get("diagnostic_refinement")
+    if not isinstance(tests_plan, dict):
+        tests_plan = _tests_fallback(raw)
+    return str(out.get("explanation") or ""), tests_plan
+
+
+def explain_and_propose_with_llm(
+    question: str,
+    patient_summary: str,
+    dbg: Dict[str, Any],
+    top_k: int = 3,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    explain_top_site_with_llm + propose_tests_with_llm in ONE call (JSON mode):
+    the evidence context / site stats / uncertainty are sent once instead of twice.
+    Returns (explanation, diagnostic_refinement).
+    """
+    body = _explain_and_propose_body(question, patient_summary, dbg, top_k=top_k)
+    _LLM_LIMITER.acquire()
+    resp = get_openai().chat.completions.create(**body)
+    return _parse_explain_and_propose(resp.choices[0].message.content)
 
 
 # -------------------------
 # Core iterative loop
 # -------------------------
+_INITIAL_QUESTION = "Explain why the top predicted primary site is most supported compared to the next two sites."
+
+_LAST_SECTIONS_HASH: Optional[str] = None  # sections whose embeddings are currently on disk
+
+# the input embedding files are shared by every patient: rebuild + read (+ validated upsert)
+# must not interleave across threads; only the LLM calls run concurrently
+_FILES_LOCK = threading.RLock()
+
+
+def _sections_hash(sections: List[Dict[str, Any]]) -> str:
+    blob = json.dumps(sections, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(blob.encode("utf-8"), digest_size=16).hexdigest()
+
+
+_COLLECTION_GEN = 0  # bumped after each validated upsert: cached searches are stale then
+
+
+def _embeddings_signature() -> tuple:
+    emb_dir = ROOT / "data" / "input" / "embeddings"
+    return tuple(
+        (p.name, st.st_mtime_ns, st.st_size)
+        for p in sorted(emb_dir.iterdir()) if p.is_file() and not p.name.startswith(".")
+        for st in (p.stat(),)
+    )
+
+
+@lru_cache(maxsize=32)
+def _predict_cached(sections_hash: str, gen: int):
+    return predict_primary_site()
+
+
+def _predict() -> Tuple[Dict[str, float], Dict[str, Any]]:
+    """
+    predict_primary_site(), reused for the same embedded sections and collection state.
+    Keyed on the content hash of the sections on disk (not file stat data: with --jobs,
+    rebuilds can follow each other within the filesystem's timestamp granularity).
+    """
+    key = _LAST_SECTIONS_HASH
+    if key is None:  # unknown / being rewritten: nothing to reuse
+        return predict_primary_site()
+    pct, dbg = _predict_cached(key, _COLLECTION_GEN)
+    return copy.deepcopy(pct), copy.deepcopy(dbg)
+
+
+_SIG_FILE = ROOT / "data" / "input" / "embeddings" / ".sig"  # hash of the embedded sections, across runs
+
+
+def _rebuild_if_changed(sections: List[Dict[str, Any]]) -> str:
+    """Re-embed only when the sections differ from the ones already on disk; returns their hash."""
+    global _LAST_SECTIONS_HASH
+    key = _sections_hash(sections)
+    if key != _LAST_SECTIONS_HASH and _LAST_SECTIONS_HASH is None:
+        # fresh process: the files may still hold these sections from a previous invocation
+        # (only trusted if no embedding file was rewritten after it, e.g. by a direct rebuild)
+        try:
+            sig_mtime = _SIG_FILE.stat().st_mtime_ns
+            files = _embeddings_signature()
+            if (
+                _SIG_FILE.read_text(encoding="utf-8").strip() == key
+                and files
+                and all(mtime <= sig_mtime for _, mtime, _ in files)
+            ):
+                _LAST_SECTIONS_HASH = key
+        except OSError:
+            pass
+    if key != _LAST_SECTIONS_HASH:
+        _LAST_SECTIONS_HASH = None  # files are being rewritten
+        _SIG_FILE.unlink(missing_ok=True)
+        rebuild_embeddings_from_sections(sections, patient_id="P_INPUT")
+        _SIG_FILE.write_text(key, encoding="utf-8")
+        _LAST_SECTIONS_HASH = key
+    return key
+
+
+def _predict_for_summary(patient_summary: str) -> Tuple[Dict[str, float], Dict[str, Any]]:
+    with _FILES_LOCK:
+        _rebuild_if_changed(build_patient_sections(patient_summary, doctor_updates=None))
+        return _predict()
+
+
 def run_iterative_refinement(
     patient_summary: str,
     doctor_updates: Optional[Dict[str, Any]] = None,
@@ -361,64 +559,88 @@ def run_iterative_refinement(
     5) if doctor_updates provided -> enrich -> rebuild -> rerun
     6) if validated -> upsert the final input case into Qdrant
     """
+    global _COLLECTION_GEN
 
     # ---------- Initial run
     sections1 = build_patient_sections(patient_summary, doctor_updates=None)
-    rebuild_embeddings_from_sections(sections1, patient_id="P_INPUT")
-
-    pct1, dbg1 = predict_primary_site()
-    top_sites_1 = [s for s, _ in dbg1.get("sorted_sites", [])[:3]]
-    pred1 = top_sites_1[0] if top_sites_1 else None
 
-    explanation1 = explain_top_site_with_llm(
-        question="Explain why the top predicted primary site is most supported compared to the next two sites.",
-        dbg=dbg1,
-    )
-
-    tests_plan = propose_tests_with_llm(patient_summary, dbg1, max_sites=3)
-
-    result: Dict[str, Any] = {
-        "initial": {
-            "predicted_primary_site": pred1,
-            "top_sites": top_sites_1,
-            "pct": pct1,
-            "explanation": explanation1,
-            "uncertainty": summarize_uncertainty(dbg1, top_k=3),
-            "evidence": dbg1.get("evidence", {}),
-        },
-        "diagnostic_refinement": tests_plan,
-        "refined": None,
-        "final_case_upsert": None,
-    }
-
-    # ---------- Refined run
-    pred_final = pred1
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        with _FILES_LOCK:
+            key1 = _rebuild_if_changed(sections1)
+
+            # the Qdrant round-trip runs in the worker; meanwhile the OpenAI client is set up
+            # (lazy imports + connection pool) and the refined sections are built
+            f_pred1 = pool.submit(_predict)
+            try:
+                get_openai()
+
+                # updates that are all empty (or add no section) would re-embed and re-search
+                # the exact same input: no refined pass then
+                sections2 = None
+                if any(v not in (None, "", [], ()) for v in (doctor_updates or {}).values()):
+                    sections2 = build_patient_sections(patient_summary, doctor_updates=doctor_updates)
+                    if _sections_hash(sections2) == key1:
+                        sections2 = None
+            finally:
+                wait([f_pred1])  # the worker reads the embedding files: keep the lock until it is done
+            pct1, dbg1 = f_pred1.result()
+
+        top_sites_1 = [s for s, _ in dbg1.get("sorted_sites", [])[:3]]
+        pred1 = top_sites_1[0] if top_sites_1 else None
+
+        # the initial LLM call (explanation + test plan in one prompt) only reads dbg1: it runs
+        # in the background (network round-trip) while the refined rebuild + search runs here
+        f_initial = pool.submit(
+            explain_and_propose_with_llm,
+            question=_INITIAL_QUESTION,
+            patient_summary=patient_summary,
+            dbg=dbg1,
+        )
 
-    if doctor_updates:
-        sections2 = build_patient_sections(patient_summary, doctor_updates=doctor_updates)
-        rebuild_embeddings_from_sections(sections2, patient_id="P_INPUT")
+        # ---------- Refined run
+        pred_final = pred1
+        refined = None
 
-        pct2, dbg2 = predict_primary_site()
-        top_sites_2 = [s for s, _ in dbg2.get("sorted_sites", [])[:3]]
-        pred2 = top_sites_2[0] if top_sites_2 else None
+        if sections2 is not None:
+            with _FILES_LOCK:
+                _rebuild_if_changed(sections2)
+                pct2, dbg2 = _predict()
+            top_sites_2 = [s for s, _ in dbg2.get("sorted_sites", [])[:3]]
+            pred2 = top_sites_2[0] if top_sites_2 else None
 
-        explanation2 = explain_top_site_with_llm(
-            question="Re-explain after updates: why the top predicted primary site is most supported vs the next two.",
-            dbg=dbg2,
-        )
+            explanation2 = explain_top_site_with_llm(
+                question="Re-explain after updates: why the top predicted primary site is most supported vs the next two.",
+                dbg=dbg2,
+            )
 
-        result["refined"] = {
-            "doctor_updates": doctor_updates,
-            "predicted_primary_site": pred2,
-            "top_sites": top_sites_2,
-            "pct": pct2,
-            "explanation": explanation2,
-            "uncertainty": summarize_uncertainty(dbg2, top_k=3),
-            "evidence": dbg2.get("evidence", {}),
+            refined = {
+                "doctor_updates": doctor_updates,
+                "predicted_primary_site": pred2,
+                "top_sites": top_sites_2,
+                "pct": pct2,
+                "explanation": explanation2,
+                "uncertainty": summarize_uncertainty(dbg2, top_k=3),
+                "evidence": dbg2.get("evidence", {}),
+            }
+
+            pred_final = pred2
+
+        explanation1, tests_plan = f_initial.result()
+
+        result: Dict[str, Any] = {
+            "initial": {
+                "predicted_primary_site": pred1,
+                "top_sites": top_sites_1,
+                "pct": pct1,
+                "explanation": explanation1,
+                "uncertainty": summarize_uncertainty(dbg1, top_k=3),
+                "evidence": dbg1.get("evidence", {}),
+            },
+            "diagnostic_refinement": tests_plan,
+            "refined": refined,
+            "final_case_upsert": None,
         }
 
-        pred_final = pred2
-
     # ---------- Validation upsert
     if validated:
         case_id = validated_case_id or f"BIOCUP_INPUT_VALIDATED_{uuid.uuid4().hex[:10]}"
@@ -427,26 +649,173 @@ def run_iterative_refinement(
         embeddings_dir = ROOT / "data" / "input" / "embeddings"
         chunks_csv = ROOT / "data" / "input" / "chunks" / "input_chunks.csv"
 
-        up = upsert_validated_input_case(
-            collection_name=COLLECTION,
-            patient_case_id=case_id,
-            predicted_primary_site=chosen_primary,
-            embeddings_dir=embeddings_dir,
-            chunks_csv=chunks_csv,
-        )
+        with _FILES_LOCK:
+            # another patient may have re-embedded in between: put this case's files back first
+            _rebuild_if_changed(sections2 if sections2 is not None else sections1)
+            up = upsert_validated_input_case(
+                collection_name=COLLECTION,
+                patient_case_id=case_id,
+                predicted_primary_site=chosen_primary,
+                embeddings_dir=embeddings_dir,
+                chunks_csv=chunks_csv,
+            )
+            _COLLECTION_GEN += 1
         result["final_case_upsert"] = up
 
     return result
 
 
+# -------------------------
+# Offline batch (many patients)
+# -------------------------
+_BATCH_DONE = {"completed", "failed", "expired", "cancelled"}
+
+
+def run_iterative_refinement_batch(
+    patients: List[Dict[str, Any]],
+    poll_max_s: float = 24 * 3600,
+) -> List[Dict[str, Any]]:
+    """
+    Initial pass for many patients, offline:
+      patients = [{"id": "...", "patient_summary": "..."}, ...]
+    Retrieval still runs patient by patient (the input embeddings live in one set of files),
+    but all LLM prompts go through ONE OpenAI Batch job (JSONL upload + polling) instead of
+    one blocking call each. Prompts missing from the batch output fall back to a direct call.
+    The interactive path stays run_iterative_refinement().
+    """
+    results: List[Dict[str, Any]] = []
+    dbgs: List[Dict[str, Any]] = []  # kept for the direct-call fallback (no second retrieval)
+    lines = []
+
+    for n, p in enumerate(patients):
+        summary = p["patient_summary"]
+        pct, dbg = _predict_for_summary(summary)
+        dbgs.append(dbg)
+        top_sites = [s for s, _ in dbg.get("sorted_sites", [])[:3]]
+
+        results.append({
+            "id": p.get("id", n),
+            "predicted_primary_site": top_sites[0] if top_sites else None,
+            "top_sites": top_sites,
+            "pct": pct,
+            "explanation": None,
+            "uncertainty": summarize_uncertainty(dbg, top_k=3),
+            "evidence": dbg.get("evidence", {}),
+            "diagnostic_refinement": None,
+        })
+        lines.append(json.dumps({
+            "custom_id": str(n),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": _explain_and_propose_body(_INITIAL_QUESTION, summary, dbg),
+        }, ensure_ascii=False))
+
+    if not lines:
+        return results
+
+    client_oa = get_openai()
+    batch_file = client_oa.files.create(
+        file=("biocup_refinement.jsonl", ("\n".join(lines) + "\n").encode("utf-8")),
+        purpose="batch",
+    )
+    batch = client_oa.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+
+    # exponential backoff polling (5s -> 5 min)
+    waited, delay = 0.0, 5.0
+    while batch.status not in _BATCH_DONE and waited < poll_max_s:
+        time.sleep(delay)
+        waited += delay
+        delay = min(delay * 2, 300.0)
+        batch = client_oa.batches.retrieve(batch.id)
+
+    if batch.status not in _BATCH_DONE:
+        # out of time: stop the job, otherwise every prompt is billed twice (batch + fallback)
+        client_oa.batches.cancel(batch.id)
+
+    replies: Dict[str, str] = {}
+    if batch.status == "completed" and batch.output_file_id:
+        for line in client_oa.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            # a malformed line only loses its own prompt (direct-call fallback below)
+            try:
+                rec = json.loads(line)
+                resp = rec.get("response") or {}
+                if resp.get("status_code") == 200:
+                    replies[rec["custom_id"]] = resp["body"]["choices"][0]["message"]["content"]
+            except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+                continue
+
+    for n, (p, r, dbg) in enumerate(zip(patients, results, dbgs)):
+        raw = replies.get(str(n))
+        if raw is not None:
+            r["explanation"], r["diagnostic_refinement"] = _parse_explain_and_propose(raw)
+        else:
+            r["explanation"], r["diagnostic_refinement"] = explain_and_propose_with_llm(
+                _INITIAL_QUESTION, p["patient_summary"], dbg,
+            )
+
+    return results
+
+
 # -------------------------
 # CLI
 # -------------------------
+def main(patients_file: str, jobs: int = 8) -> None:
+    """
+    Evaluation mode: one run_iterative_refinement per line of a JSONL file
+      {"id": "...", "patient_summary": "...", "doctor_updates": {...}, ...}
+    fanned out over `jobs` threads. Retrieval is serialized on _FILES_LOCK, so the overlap
+    comes from the OpenAI waits (shared client + rate limiter).
+    """
+    with open(patients_file, "r", encoding="utf-8") as f:
+        patients = [json.loads(line) for line in f if line.strip()]
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as ex:
+        futures = {}
+        for n, p in enumerate(patients):
+            kwargs = {k: v for k, v in p.items() if k != "id"}
+            futures[ex.submit(run_iterative_refinement, **kwargs)] = p.get("id", n)
+        for fut in as_completed(futures):
+            pid = futures[fut]
+            try:
+                out = {"id": pid, **fut.result()}
+            except Exception as e:
+                out = {"id": pid, "error": repr(e)}
+            print(json.dumps(out, ensure_ascii=False), flush=True)
+
+
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="BIOCUP diagnostic refinement")
+    parser.add_argument("--patients", help="JSONL file, one patient per line (evaluation mode)")
+    parser.add_argument("--jobs", type=int, default=8, help="patients processed concurrently")
+    parser.add_argument("--rpm", type=int, default=None, help="OpenAI requests/minute cap (default: $OPENAI_RPM)")
+    args = parser.parse_args()
+    if args.rpm is not None:
+        _LLM_LIMITER = _RateLimiter(args.rpm)
+
     print("QDRANT_URL:", os.environ.get("QDRANT_URL"))
     print("COLLECTION_NAME:", COLLECTION)
 
-    if not qdrant.collection_exists(COLLECTION):
+    import grpc
+
+    # one round-trip on the normal path; the collection list is only fetched to diagnose a miss
+    # (a miss is a 404 over REST, NOT_FOUND over gRPC)
+    try:
+        info = qdrant.get_collection(COLLECTION)
+    except (UnexpectedResponse, grpc.RpcError) as e:
+        if isinstance(e, UnexpectedResponse):
+            not_found = e.status_code == 404
+        else:
+            not_found = e.code() == grpc.StatusCode.NOT_FOUND
+        if not not_found:
+            raise
         cols = qdrant.get_collections().collections
         print("\n❌ Collection not found:", COLLECTION)
         print("✅ Available collections:")
@@ -454,8 +823,15 @@ if __name__ == "__main__":
             print(" -", c.name)
         raise SystemExit(1)
 
-    info = qdrant.get_collection(COLLECTION)
     print(f"\n✅ Collection status: {info.status} points: {info.points_count}\n")
+    # read-only check: the collection config (int8 quantization, HNSW) lives in
+    # backend/indexing/create_collection.py
+    if info.config.quantization_config is None:
+        print("⚠️ Collection has no int8 quantization: recreate it with backend/indexing/create_collection.py\n")
+
+    if args.patients:
+        main(args.patients, jobs=args.jobs)
+        raise SystemExit(0)
 
     patient_summary = "CUP case summary: metastasis noted; primary uncertain."
 
@@ -0,0 +1,71 @@
+# backend/search/evidence_context.py
+# ============================================================
+# BioCUP — Evidence context sent to the LLM (shared by explain / diagnostic_refine)
+# ============================================================
+
+import io
+import json
+import re
+
+_WS = re.compile(r"\s+")
+
+
+def build_context_from_evidence(
+    evidence_by_site: dict,
+    top_sites: list,
+    max_items_per_site: int = 6,
+    max_chars: int = 6000,
+) -> str:
+    """
+    Context sent to LLM: includes scores (OK) to help ranking,
+    but we will NOT display scores to the user.
+    """
+    # written straight into one buffer (blank line between blocks), stops as soon as
+    # the budget is reached; each snippet gets an equal share of max_chars
+    buf = io.StringIO()
+    total = 0
+    per_item_cap = max(200, max_chars // max(1, len(top_sites) * max_items_per_site))
+
+    # a (case_id, section, snippet) already written is not sent again: a one-line
+    # back-reference replaces it and the co-occurrence is summarized at the end
+    seen = {}
+    shared = {}  # same key as `seen`: two snippets of one case/section stay two entries
+
+    for i, site in enumerate(top_sites):
+        if total >= max_chars:
+            break
+        buf.write(f"\n\n### SITE: {site}\n" if i else f"\n### SITE: {site}\n")
+        for e in evidence_by_site.get(site, [])[:max_items_per_site]:
+            case_id = e.get("case_id")
+            sec = e.get("section")
+            score = e.get("score")
+            # whitespace runs / markdown bold cost tokens and carry nothing
+            snippet = _WS.sub(" ", e.get("snippet") or "").replace("**", "").strip()[:per_item_cap]
+
+            score_val = float(score) if score is not None else 0.0
+            header = f"(case_id={case_id}, section={sec}, score={score_val:.4f})"
+
+            key = (case_id, sec, snippet)
+            first_site = seen.get(key)
+            if first_site is None:
+                seen[key] = site
+                buf.write("\n")
+                total += buf.write(f"{header}\n")
+                total += buf.write(snippet) + buf.write("\n")
+            elif first_site == site:
+                continue  # same snippet twice under one site
+            else:
+                sites = shared.setdefault(key, [first_site])
+                if site not in sites:
+                    sites.append(site)
+                total += buf.write(f"\n{header} [also site {first_site}]\n")
+            if total >= max_chars:
+                break
+
+    if shared:
+        rows = [
+            {"case_id": c, "section": s, "snippet": snip[:60], "sites": sites}
+            for (c, s, snip), sites in shared.items()
+        ]
+        buf.write(f"\n### shared_across_sites: {json.dumps(rows, ensure_ascii=False, default=str)}\n")
+    return buf.getvalue()
@@ -2,9 +2,10 @@
 import os
 import sys
 import json
+import time
+import hashlib
 from pathlib import Path
 from dotenv import load_dotenv
-from qdrant_client import QdrantClient
 
 # -------------------------
 # Path + env
@@ -16,12 +17,12 @@ load_dotenv(dotenv_path=ROOT / ".env", override=True)
 
 COLLECTION = os.getenv("COLLECTION_NAME", "biocup_hybrid_splade_v1")
 
-qdrant = QdrantClient(
-    url=os.environ["QDRANT_URL"],
-    api_key=os.environ.get("QDRANT_API_KEY")
-)
-
 from backend.search.search import predict_primary_site
+from backend.search.evidence_context import build_context_from_evidence
+from backend.search._qdrant import get_qdrant
+from backend.search._openai import get_openai
+
+qdrant = get_qdrant()
 
 
 # -------------------------
@@ -39,52 +40,69 @@ def _pct_lookup(percentages: dict, site: str) -> float:
     return 0.0
 
 
-def build_context_from_evidence(
-    evidence_by_site: dict,
-    top_sites: list,
-    max_items_per_site: int = 6,
-    max_chars: int = 6000
-) -> str:
-    """
-    Context sent to LLM: includes scores (OK) to help ranking,
-    but we will NOT display scores to the user.
-    """
-    blocks = []
-    total = 0
+# -------------------------
+# LLM answer cache (exact key)
+# -------------------------
+# same model + same prompt -> same answer at temperature 0: one JSON file per key,
+# reused for LLM_CACHE_TTL seconds (0 disables the cache)
+LLM_CACHE_DIR = ROOT / ".llm_cache"
+LLM_CACHE_TTL = float(os.getenv("BIOCUP_LLM_CACHE_TTL", "86400"))
 
-    for site in top_sites:
-        blocks.append(f"\n### SITE: {site}\n")
-        for e in evidence_by_site.get(site, [])[:max_items_per_site]:
-            case_id = e.get("case_id")
-            sec = e.get("section")
-            score = e.get("score")
-            snippet = e.get("snippet") or ""
 
-            score_val = float(score) if score is not None else 0.0
+def _cache_key(*parts: str) -> str:
+    h = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
 
-            block = (
-                f"(case_id={case_id}, section={sec}, score={score_val:.4f})\n"
-                f"{snippet}\n"
-            )
-            blocks.append(block)
-            total += len(block)
-            if total >= max_chars:
-                break
-        if total >= max_chars:
-            break
 
-    return "\n".join(blocks)
+def _cache_get(key: str):
+    if LLM_CACHE_TTL <= 0:
+        return None
+    try:
+        rec = json.loads((LLM_CACHE_DIR / f"{key}.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if time.time() - float(rec.get("t", 0)) > LLM_CACHE_TTL:
+        return None
+    return rec.get("answer")
 
 
-def explain_with_llm(question: str, context: str) -> str:
-    from openai import OpenAI
+def _cache_set(key: str, answer: str) -> None:
+    if LLM_CACHE_TTL <= 0:
+        return
+    LLM_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = LLM_CACHE_DIR / f"{key}.{os.getpid()}.tmp"
+    tmp.write_text(json.dumps({"t": time.time(), "answer": answer}, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, LLM_CACHE_DIR / f"{key}.json")  # readers never see a half-written file
+
 
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("Missing OPENAI_API_KEY in BIOCUP1/.env")
+# -------------------------
+# Streamed generation, persisted as NDJSON
+# -------------------------
+# {"key", "t"} header, one {"t", "d"} line per delta, {"done": true} at the end:
+# what was generated survives a crash; a complete file for the same prompt is reused
+# under the same LLM_CACHE_TTL as the answer cache (never when it is 0)
+STREAM_NDJSON = ROOT / "backend" / "search" / "explain_stream.ndjson"
 
-    client_oa = OpenAI(api_key=api_key)
 
+def _read_stream(key: str):
+    if LLM_CACHE_TTL <= 0:
+        return None
+    try:
+        with open(STREAM_NDJSON, "r", encoding="utf-8") as f:
+            recs = [json.loads(line) for line in f if line.strip()]
+    except (OSError, ValueError):
+        return None
+    if len(recs) < 2 or recs[0].get("key") != key or not recs[-1].get("done"):
+        return None
+    if time.time() - float(recs[0].get("t", 0)) > LLM_CACHE_TTL:
+        return None
+    return "".join(r.get("d", "") for r in recs[1:-1])
+
+
+def explain_with_llm(question: str, context: str) -> str:
     system = (
         "You are a clinical retrieval assistant for BioCUP.\n"
         "Rules:\n"
@@ -108,15 +126,42 @@ def explain_with_llm(question: str, context: str) -> str:
         "Use citations like (BIOCUP_00001, IHC).\n"
     )
 
+    model = os.getenv("BIOCUP_OPENAI_MODEL", "gpt-4o-mini")
+    key = _cache_key(model, system, user)
+    cached = _cache_get(key)
+    if cached is None:
+        cached = _read_stream(key)
+    if cached is not None:
+        return cached
+
+    client_oa = get_openai()
     resp = client_oa.chat.completions.create(
-        model=os.getenv("BIOCUP_OPENAI_MODEL", "gpt-4o-mini"),
+        model=model,
         temperature=0.0,
         messages=[
             {"role": "system", "content": system},
             {"role": "user", "content": user},
         ],
+        stream=True,
     )
-    return resp.choices[0].message.content
+
+    out = []
+    with open(STREAM_NDJSON, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"key": key, "t": time.time()}) + "\n")
+        for chunk in resp:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content or ""
+            if not delta:
+                continue
+            out.append(delta)
+            f.write(json.dumps({"t": time.time(), "d": delta}, ensure_ascii=False) + "\n")
+            f.flush()
+        f.write(json.dumps({"done": True, "t": time.time()}) + "\n")
+
+    answer = "".join(out)
+    _cache_set(key, answer)
+    return answer
 
 
 def format_console_report(
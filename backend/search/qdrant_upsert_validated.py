@@ -27,19 +27,20 @@ def upsert_validated_input_case(
 
     REQUIREMENTS:
     - dense.npy  shape (N, dim)
-    - sparse_splade.npz with arrays: indices, values
+    - sparse_splade.npz in CSR form: indptr (N+1), indices, values
     - meta.parquet with N rows
     - input_chunks.csv containing chunk_text + section + chunk_index (at least)
     """
 
     client = QdrantClient(url=url, api_key=api_key) if url else QdrantClient()
 
-    dense = np.load(embeddings_dir / "dense.npy").astype("float32")
+    dense = np.load(embeddings_dir / "dense.npy", mmap_mode="r")
     meta = pd.read_parquet(embeddings_dir / "meta.parquet")
 
-    sp = np.load(embeddings_dir / "sparse_splade.npz", allow_pickle=True)
-    sp_indices = sp["indices"]
-    sp_values = sp["values"]
+    sp = np.load(embeddings_dir / "sparse_splade.npz")
+    # CSR on disk -> one view per chunk
+    sp_indices = np.split(sp["indices"], sp["indptr"][1:-1])
+    sp_values = np.split(sp["values"], sp["indptr"][1:-1])
 
     chunks_df = pd.read_csv(chunks_csv)
 
@@ -69,10 +70,10 @@ def upsert_validated_input_case(
             "has_size": bool(row.get("has_size", 0)),
         }
 
-        vec_dense = dense[i]
+        vec_dense = dense[i].astype("float32").tolist()
         vec_sparse = qm.SparseVector(
-            indices=list(sp_indices[i]),
-            values=list(sp_values[i]),
+            indices=sp_indices[i].tolist(),
+            values=sp_values[i].astype(np.float32).tolist(),
         )
 
         points.append(
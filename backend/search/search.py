@@ -16,14 +16,13 @@
 #   primary_site score = SUM(case_score for cases of that site)
 # ============================================================
 
-import os
 import numpy as np
 import pandas as pd
 from pathlib import Path
 from collections import defaultdict
+from functools import lru_cache
 from dotenv import load_dotenv
 
-from qdrant_client import QdrantClient
 from qdrant_client.http import models as qm
 import sys
 from pathlib import Path
@@ -57,6 +56,12 @@ K_FUSED = 50
 # Fusion parameter
 RRF_K = 60
 
+# Payload fields read by fusion / scoring / evidence (the rest of the stored
+# payload — has_*, sub_index, ... — is not sent back by Qdrant)
+PAYLOAD_FIELDS = qm.PayloadSelectorInclude(
+    include=["primary_site", "case_id", "section", "chunk_text", "chunk_id_raw"]
+)
+
 # To prevent dilution: per input chunk, keep only top cases
 MAX_CASES_PER_INPUT_CHUNK = 15
 
@@ -145,9 +150,15 @@ def clinical_quality_boost(payload: dict) -> float:
     > 1.0 => boost (discriminative chunks)
     < 1.0 => penalty (generic chunks)
     """
-    sec = str(payload.get("section", "")).upper()
-    txt = str(payload.get("chunk_text", "")).lower()
+    return _quality_boost(
+        str(payload.get("section", "")).upper(),
+        str(payload.get("chunk_text", "")).lower(),
+    )
 
+
+@lru_cache(maxsize=8192)
+def _quality_boost(sec: str, txt: str) -> float:
+    # keyed on (section, lowercased text): the same chunk comes back for many queries
     boost = 1.0
 
     # Strong sections boost
@@ -172,10 +183,9 @@ def is_strong_section(sec) -> bool:
 # =========================
 # QDRANT CLIENT
 # =========================
-client = QdrantClient(
-    url=os.environ["QDRANT_URL"],
-    api_key=os.environ.get("QDRANT_API_KEY"),
-)
+from backend.search._qdrant import get_qdrant, DENSE_SEARCH_PARAMS
+
+client = get_qdrant()  # shared with explain / diagnostic_refine
 
 # =========================
 # IO
@@ -224,23 +234,29 @@ def build_filter_for_input_chunk(input_section: str) -> qm.Filter:
 # RRF FUSION
 # =========================
 def rrf_fuse(dense_points, sparse_points, k=RRF_K):
-    id2score = {}
-    id2payload = {}
-
-    for rank, p in enumerate(dense_points):
-        pid = p.id
-        id2score[pid] = id2score.get(pid, 0.0) + 1.0 / (k + rank + 1)
-        if pid not in id2payload and p.payload:
-            id2payload[pid] = p.payload
+    pts = list(dense_points) + list(sparse_points)
+    if not pts:
+        return [], {}, {}
+
+    # reciprocal rank of every hit, summed per point id in one bincount; ids are coded
+    # as Python objects (mixed int / UUID-string ids must keep their own type)
+    ranks = np.concatenate([np.arange(len(dense_points)), np.arange(len(sparse_points))])
+    rr = 1.0 / (k + ranks + 1)
+    codes = {}
+    inv = [codes.setdefault(p.id, len(codes)) for p in pts]
+    agg = np.bincount(inv, weights=rr)
+
+    # best first, ties in order of first appearance (codes are numbered in that order)
+    ids = list(codes)
+    order = np.argsort(-agg, kind="stable")
+    fused_ids = [ids[j] for j in order]
+    id2score = dict(zip(ids, agg.tolist()))
 
-    for rank, p in enumerate(sparse_points):
-        pid = p.id
-        id2score[pid] = id2score.get(pid, 0.0) + 1.0 / (k + rank + 1)
-        if pid not in id2payload and p.payload:
-            id2payload[pid] = p.payload
+    id2payload = {}
+    for p in pts:
+        if p.payload and p.id not in id2payload:
+            id2payload[p.id] = p.payload
 
-    fused = sorted(id2score.items(), key=lambda x: x[1], reverse=True)
-    fused_ids = [pid for pid, _ in fused]
     return fused_ids, id2score, id2payload
 
 # =========================
@@ -249,9 +265,11 @@ def rrf_fuse(dense_points, sparse_points, k=RRF_K):
 def predict_primary_site():
     # Load input embeddings
     meta = read_meta(META_PATH)
-    dense = np.load(DENSE_PATH)
-    sp = np.load(SPARSE_PATH, allow_pickle=True)
-    sp_indices, sp_values = sp["indices"], sp["values"]
+    dense = np.load(DENSE_PATH, mmap_mode="r")
+    sp = np.load(SPARSE_PATH)
+    # CSR on disk -> one view per chunk
+    sp_indices = np.split(sp["indices"], sp["indptr"][1:-1])
+    sp_values = np.split(sp["values"], sp["indptr"][1:-1])
 
     N = len(meta)
     assert dense.shape[0] == N == len(sp_indices) == len(sp_values), "❌ Input files misaligned"
@@ -264,49 +282,67 @@ def predict_primary_site():
     case_site = {}                                 # case_id -> primary_site
 
     # -----------------------------
-    # For EACH INPUT chunk:
-    #   1) query dense
-    #   2) query sparse
-    #   3) fuse
-    #   4) reduce to BEST per case for this chunk
+    # ALL input chunks in ONE round-trip:
+    #   dense + sparse request per chunk -> query_batch_points
+    #   (Qdrant runs them server-side; results come back in request order)
+    # identical input chunks (same section + same vectors) share one query group
     # -----------------------------
-    for i in range(N):
-        row = meta.iloc[i]
-        input_section = str(row.get("section", "GENERAL"))
-        sec_w = w_section(input_section)
-
-        q_dense = dense[i].tolist()
-        q_sparse = qm.SparseVector(
-            indices=sp_indices[i].tolist(),
-            values=sp_values[i].tolist()
-        )
-        flt = build_filter_for_input_chunk(input_section)
+    input_sections = [str(meta.iloc[i].get("section", "GENERAL")) for i in range(N)]
+    filters = {}   # one Filter per distinct input section
+    groups = {}    # (section, dense bytes, sparse bytes) -> query group
+    group_of = []  # input chunk i -> query group
+    requests = []
+    for i, input_section in enumerate(input_sections):
+        key = (input_section, dense[i].tobytes(), sp_indices[i].tobytes(), sp_values[i].tobytes())
+        g = groups.get(key)
+        if g is not None:
+            group_of.append(g)
+            continue
+        g = groups[key] = len(groups)
+        group_of.append(g)
+
+        flt = filters.get(input_section)
+        if flt is None:
+            flt = filters[input_section] = build_filter_for_input_chunk(input_section)
 
-        # ---- Dense
-        dense_res = client.query_points(
-            collection_name=COLLECTION,
-            query=q_dense,
+        requests.append(qm.QueryRequest(
+            query=dense[i].tolist(),
             using="dense",
-            query_filter=flt,
+            filter=flt,
             limit=K_DENSE,
-            with_payload=True
-        )
-        dense_pts = dense_res.points or []
-
-        # ---- Sparse
-        sparse_res = client.query_points(
-            collection_name=COLLECTION,
-            query=q_sparse,
+            params=DENSE_SEARCH_PARAMS,
+            with_payload=PAYLOAD_FIELDS
+        ))
+        requests.append(qm.QueryRequest(
+            query=qm.SparseVector(
+                indices=sp_indices[i].tolist(),
+                values=sp_values[i].tolist()
+            ),
             using="sparse",
-            query_filter=flt,
+            filter=flt,
             limit=K_SPARSE,
-            with_payload=True
-        )
-        sparse_pts = sparse_res.points or []
+            with_payload=PAYLOAD_FIELDS
+        ))
+
+    responses = client.query_batch_points(collection_name=COLLECTION, requests=requests) if requests else []
+
+    # -----------------------------
+    # For EACH INPUT chunk:
+    #   1) fuse dense + sparse (once per query group)
+    #   2) reduce to BEST per case for this chunk
+    # -----------------------------
+    fused_by_group = {}
+    for i in range(N):
+        sec_w = w_section(input_sections[i])
 
         # ---- Fuse (RRF)
-        fused_ids, id2rrf, id2payload = rrf_fuse(dense_pts, sparse_pts, k=RRF_K)
-        fused_ids = fused_ids[:K_FUSED]
+        g = group_of[i]
+        if g not in fused_by_group:
+            dense_pts = responses[2 * g].points or []
+            sparse_pts = responses[2 * g + 1].points or []
+            fused_ids, id2rrf, id2payload = rrf_fuse(dense_pts, sparse_pts, k=RRF_K)
+            fused_by_group[g] = (fused_ids[:K_FUSED], id2rrf, id2payload)
+        fused_ids, id2rrf, id2payload = fused_by_group[g]
 
         # ---- Reduce: keep BEST score per CASE for this input chunk
         best_case_this_chunk = {}       # case_id -> best contrib
@@ -354,24 +390,24 @@ def predict_primary_site():
     # -----------------------------
     # Final case score with consistency bonus + clinical quality boost
     # -----------------------------
-    case_final_score = {}
-    for cid, base_sum in case_total_score.items():
-        support = len(case_supported_by_chunks[cid])
-        bonus = 1.0 + CONSISTENCY_BONUS * max(0, support - 1)
-
-        payload = case_best_payload.get(cid, {})
-        qual = clinical_quality_boost(payload)  # re-ranking quality factor
-
-        case_final_score[cid] = float(base_sum) * float(bonus) * float(qual)
+    # parallel arrays indexed like cids (one row per case)
+    cids = list(case_total_score)
+    n_cases = len(cids)
+    base = np.fromiter((case_total_score[c] for c in cids), dtype=np.float64, count=n_cases)
+    support = np.fromiter((len(case_supported_by_chunks[c]) for c in cids), dtype=np.int64, count=n_cases)
+    bonus = 1.0 + CONSISTENCY_BONUS * np.maximum(support - 1, 0)
+    qual = np.fromiter(  # re-ranking quality factor
+        (clinical_quality_boost(case_best_payload.get(c, {})) for c in cids), dtype=np.float64, count=n_cases
+    )
+    final = base * bonus * qual
+    case_final_score = dict(zip(cids, final.tolist()))
 
     # -----------------------------
     # Aggregate by primary_site (pre-calibration)
     # -----------------------------
-    site_scores = defaultdict(float)
-    for cid, sc in case_final_score.items():
-        site = case_site.get(cid)
-        if site:
-            site_scores[site] += float(sc)
+    site_idx, site_names = pd.factorize(pd.Series([case_site.get(c) or None for c in cids], dtype=object))
+    has_site = site_idx >= 0
+    site_sums = np.bincount(site_idx[has_site], weights=final[has_site], minlength=len(site_names))
 
     # -----------------------------
     # Evidence: best cases per site (build BEFORE calibration)
@@ -412,15 +448,15 @@ def predict_primary_site():
             if is_strong_section(e.get("section"))
         )
 
-    for site in list(site_scores.keys()):
-        if site_strong_counts.get(site, 0) < 2:
-            site_scores[site] *= 0.75
+    weak = np.fromiter((site_strong_counts.get(s, 0) < 2 for s in site_names), dtype=bool, count=len(site_names))
+    site_sums = np.where(weak, site_sums * 0.75, site_sums)
+    site_scores = dict(zip(site_names.tolist(), site_sums.tolist()))
 
     # -----------------------------
     # Normalize -> %
     # -----------------------------
-    total = sum(site_scores.values())
-    pct = {s: (v / total) * 100.0 for s, v in site_scores.items()} if total > 0 else {}
+    total = float(site_sums.sum())
+    pct = dict(zip(site_scores, (site_sums / total * 100.0).tolist())) if total > 0 else {}
     sorted_sites = sorted(pct.items(), key=lambda x: x[1], reverse=True)
 
     debug = {
@@ -11,7 +11,6 @@ from pathlib import Path
 from collections import defaultdict
 from dotenv import load_dotenv
 
-from qdrant_client import QdrantClient
 from qdrant_client.http import models as qm
 
 # ------------------------------------------------------------
@@ -63,10 +62,9 @@ def is_strong_section(sec) -> bool:
 # ------------------------------------------------------------
 # Qdrant
 # ------------------------------------------------------------
-client = QdrantClient(
-    url=os.environ["QDRANT_URL"],
-    api_key=os.environ.get("QDRANT_API_KEY"),
-)
+from backend.search._qdrant import get_qdrant, DENSE_SEARCH_PARAMS
+
+client = get_qdrant()  # shared with explain / diagnostic_refine
 
 # ------------------------------------------------------------
 # Load chunk text once (FAST)
@@ -128,8 +126,11 @@ def rrf_fuse(dense_pts, sparse_pts, k=RRF_K):
 # ------------------------------------------------------------
 def predict_primary_site():
     meta = pd.read_parquet(META_PATH)
-    dense = np.load(DENSE_PATH)
-    sp = np.load(SPARSE_PATH, allow_pickle=True)
+    dense = np.load(DENSE_PATH, mmap_mode="r")
+    sp = np.load(SPARSE_PATH)
+    # CSR on disk -> one view per chunk
+    sp_indices = np.split(sp["indices"], sp["indptr"][1:-1])
+    sp_values = np.split(sp["values"], sp["indptr"][1:-1])
 
     N = len(meta)
 
@@ -138,25 +139,37 @@ def predict_primary_site():
     case_payload = {}
     case_site = {}
 
-    for i in range(N):
-        sec = meta.iloc[i].get("section", "GENERAL")
-        flt = build_filter(sec)
-
-        d = client.query_points(
-            COLLECTION, dense[i].tolist(),
-            using="dense", limit=K_DENSE,
-            query_filter=flt, with_payload=True
-        ).points or []
-
-        s = client.query_points(
-            COLLECTION,
-            qm.SparseVector(
-                indices=sp["indices"][i].tolist(),
-                values=sp["values"][i].tolist(),
+    # dense + sparse request per input chunk, all sent in ONE round-trip
+    # (results come back in request order)
+    sections = [meta.iloc[i].get("section", "GENERAL") for i in range(N)]
+    filters = {}
+    requests = []
+    for i, sec in enumerate(sections):
+        flt = filters.get(sec)
+        if flt is None:
+            flt = filters[sec] = build_filter(sec)
+        requests += [
+            qm.QueryRequest(
+                query=dense[i].tolist(),
+                using="dense", limit=K_DENSE,
+                params=DENSE_SEARCH_PARAMS,
+                filter=flt, with_payload=True
+            ),
+            qm.QueryRequest(
+                query=qm.SparseVector(
+                    indices=sp_indices[i].tolist(),
+                    values=sp_values[i].tolist(),
+                ),
+                using="sparse", limit=K_SPARSE,
+                filter=flt, with_payload=True
             ),
-            using="sparse", limit=K_SPARSE,
-            query_filter=flt, with_payload=True
-        ).points or []
+        ]
+    responses = client.query_batch_points(COLLECTION, requests=requests) if requests else []
+
+    for i in range(N):
+        sec = sections[i]
+        d = responses[2 * i].points or []
+        s = responses[2 * i + 1].points or []
 
         fused, scores, payloads = rrf_fuse(d, s)
 